@@ -1,5 +1,6 @@
 from django.contrib import admin
-from .models import ChatRoom, Message
+from .models import ChatRoom, Message, MessageArchive, RoomReadCursor
+from . import search
 
 @admin.register(ChatRoom)
 class ChatRoomAdmin(admin.ModelAdmin):
@@ -17,14 +18,37 @@ class ChatRoomAdmin(admin.ModelAdmin):
 class MessageAdmin(admin.ModelAdmin):
     list_display = ['id', 'room_id', 'sender', 'content_preview', 'is_read', 'created_at']
     list_filter = ['is_read', 'created_at', 'sender__role']
-    search_fields = ['sender__email', 'content', 'room__customer__email', 'room__professional__email']
+    # content goes through the full-text index instead of an icontains scan
+    search_fields = ['sender__email', 'room__customer__email', 'room__professional__email']
     readonly_fields = ['created_at']
     raw_id_fields = ['room', 'sender']
     
     def content_preview(self, obj):
         return obj.content[:50] + '...' if len(obj.content) > 50 else obj.content
     content_preview.short_description = 'Content'
+
+    def get_search_results(self, request, queryset, search_term):
+        results, may_have_duplicates = super().get_search_results(request, queryset, search_term)
+        if search_term:
+            # only narrows what the changelist filters already selected
+            results |= search.match(queryset, search_term)
+        return results, may_have_duplicates
     
     def room_id(self, obj):
         return obj.room.id
-    room_id.short_description = 'Room ID'
\ No newline at end of file
+    room_id.short_description = 'Room ID'
+
+
+@admin.register(RoomReadCursor)
+class RoomReadCursorAdmin(admin.ModelAdmin):
+    list_display = ['id', 'room', 'user', 'last_read_message_id', 'updated_at']
+    readonly_fields = ['updated_at']
+    raw_id_fields = ['room', 'user']
+
+
+@admin.register(MessageArchive)
+class MessageArchiveAdmin(admin.ModelAdmin):
+    list_display = ['id', 'room', 'month', 'message_count', 'first_id', 'last_id']
+    list_filter = ['month']
+    exclude = ['payload']
+    readonly_fields = ['room', 'month', 'message_count', 'first_id', 'last_id', 'first_created_at', 'last_created_at']
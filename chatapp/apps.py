@@ -4,3 +4,6 @@ from django.apps import AppConfig
 class ChatappConfig(AppConfig):
     default_auto_field = 'django.db.models.BigAutoField'
     name = 'apps.chatapp'
+
+    def ready(self):
+        from apps.chatapp import signals  # noqa
@@ -0,0 +1,225 @@
+"""
+Cold archive tier for chat messages.
+
+The hot Message table only keeps recent months. `manage.py rotate_message_archive`
+moves whole months older than CHAT_ARCHIVE_AFTER_MONTHS into MessageArchive,
+one row per room and month, holding the month's messages as zlib-compressed
+JSON rows (history_cache.message_row format), and deletes them from the hot
+table. ChatRoom.archived_through records how far a room has been archived.
+
+History reads (REST room messages, WebSocket history frames) go through
+room_page() / extend_latest(): pages are served from the hot table and, once
+it runs out, continue transparently into the archive, one decompressed month
+at a time. Rooms that were never archived pay nothing extra. Archived
+messages are not full-text searchable.
+"""
+import json
+import zlib
+from datetime import date, datetime, time as dt_time
+
+from django.conf import settings
+from django.db import transaction
+from django.db.models import Q, Sum
+from django.utils import timezone
+from django.utils.dateparse import parse_datetime
+
+from . import history_cache, receipts
+from .signals import notify_room_invalidated
+from .models import ChatRoom, Message, MessageArchive
+from .pagination import HISTORY_LIMIT, message_page
+
+ARCHIVE_AFTER_MONTHS = getattr(settings, 'CHAT_ARCHIVE_AFTER_MONTHS', 12)
+ARCHIVE_COMPRESSION_LEVEL = 6
+DELETE_CHUNK_SIZE = 1000
+
+
+# ---------------- Months ----------------
+def month_start(value):
+    return date(value.year, value.month, 1)
+
+
+def add_months(month, months):
+    index = month.year * 12 + month.month - 1 + months
+    return date(index // 12, index % 12 + 1, 1)
+
+
+def month_bounds(month):
+    """[start, end) datetimes of a month in the current timezone."""
+    tz = timezone.get_current_timezone() if settings.USE_TZ else None
+
+    def at_midnight(day):
+        moment = datetime.combine(day, dt_time.min)
+        return timezone.make_aware(moment, tz) if tz is not None else moment
+
+    return at_midnight(month), at_midnight(add_months(month, 1))
+
+
+def archivable_months(months=ARCHIVE_AFTER_MONTHS):
+    """Months with hot messages older than the retention window, oldest first."""
+    cutoff = add_months(month_start(timezone.localtime() if settings.USE_TZ else timezone.now()), -months)
+    oldest = Message.objects.filter(room__isnull=False).order_by('created_at').values_list('created_at', flat=True).first()
+    if oldest is None:
+        return []
+    if settings.USE_TZ:
+        oldest = timezone.localtime(oldest)
+    month = month_start(oldest)
+    result = []
+    while month < cutoff:
+        result.append(month)
+        month = add_months(month, 1)
+    return result
+
+
+# ---------------- Writing ----------------
+def _encode(rows):
+    return zlib.compress(json.dumps(rows, separators=(',', ':')).encode(), ARCHIVE_COMPRESSION_LEVEL)
+
+
+def _decode(segment):
+    return json.loads(zlib.decompress(bytes(segment.payload)))
+
+
+def _key(row):
+    return parse_datetime(row['created_at']), row['id']
+
+
+def archive_month(month):
+    """Move one month of messages, room by room, into the archive. Returns the number moved."""
+    start, end = month_bounds(month)
+    in_month = Message.objects.filter(created_at__gte=start, created_at__lt=end, room__isnull=False)
+    room_ids = list(in_month.order_by().values_list('room_id', flat=True).distinct())
+    moved = 0
+    for room_id in room_ids:
+        # one transaction per room: a failure never loses or duplicates messages
+        with transaction.atomic():
+            messages = list(in_month.filter(room_id=room_id).select_related('sender').order_by('created_at', 'id'))
+            if not messages:
+                continue
+            rows = [history_cache.message_row(m) for m in messages]
+            segment = MessageArchive.objects.select_for_update().filter(room_id=room_id, month=month).first()
+            if segment is not None:
+                rows = sorted(_decode(segment) + rows, key=_key)
+            else:
+                segment = MessageArchive(room_id=room_id, month=month)
+            segment.first_id = min(row['id'] for row in rows)
+            segment.last_id = max(row['id'] for row in rows)
+            segment.first_created_at = parse_datetime(rows[0]['created_at'])
+            segment.last_created_at = parse_datetime(rows[-1]['created_at'])
+            segment.message_count = len(rows)
+            segment.payload = _encode(rows)
+            segment.save()
+
+            ids = [m.id for m in messages]
+            for i in range(0, len(ids), DELETE_CHUNK_SIZE):
+                Message.objects.filter(id__in=ids[i:i + DELETE_CHUNK_SIZE]).delete()
+            ChatRoom.objects.filter(pk=room_id).filter(
+                Q(archived_through__isnull=True) | Q(archived_through__lt=end)
+            ).update(archived_through=end, updated_at=timezone.now())
+            transaction.on_commit(lambda room_id=room_id: _archived(room_id))
+        moved += len(messages)
+    return moved
+
+
+def _archived(room_id):
+    history_cache.invalidate([room_id])
+    # open sockets reload the room and pick up archived_through
+    room = ChatRoom.objects.filter(pk=room_id).first()
+    if room is not None:
+        notify_room_invalidated(room)
+
+
+# ---------------- Reading ----------------
+def archived_rows(room_id, before=None, after=None, limit=HISTORY_LIMIT):
+    """
+    Archived rows of a room, oldest first, keyset on (created_at, id):
+    the `limit` rows just before `before` (or the newest ones), or just after
+    `after`. Returns (rows, has_more). Segments are decompressed lazily,
+    newest (or oldest) month first, until the page is full.
+    """
+    segments = MessageArchive.objects.filter(room_id=room_id)
+    if after is not None:
+        segments = segments.filter(last_created_at__gte=after[0]).order_by('month')
+    else:
+        if before is not None:
+            segments = segments.filter(first_created_at__lte=before[0])
+        segments = segments.order_by('-month')
+
+    collected = []
+    for segment in segments.iterator(chunk_size=4):
+        rows = _decode(segment)
+        if after is not None:
+            collected.extend(row for row in rows if _key(row) > after)
+        else:
+            collected[:0] = [row for row in rows if before is None or _key(row) < before]
+        if len(collected) > limit:
+            break
+    has_more = len(collected) > limit
+    if after is not None:
+        return collected[:limit], has_more
+    return (collected[-limit:] if limit else []), has_more
+
+
+def find_archived(room_id, message_id):
+    segments = MessageArchive.objects.filter(room_id=room_id, first_id__lte=message_id, last_id__gte=message_id)
+    for segment in segments:
+        for row in _decode(segment):
+            if row['id'] == message_id:
+                return row
+    return None
+
+
+def archived_count(room):
+    if room.archived_through is None:
+        return 0
+    return room.archives.aggregate(total=Sum('message_count'))['total'] or 0
+
+
+def _messages(room_id, rows):
+    return receipts.apply_read_state(history_cache.rows_to_messages(room_id, rows))
+
+
+def room_page(room, queryset, before_id=None, after_id=None, limit=HISTORY_LIMIT):
+    """pagination.message_page for one room's timeline, continued into its archive."""
+    # serializers render the sender's profile name
+    queryset = queryset.select_related('sender__profile')
+    if room.archived_through is None:
+        return message_page(queryset, before_id=before_id, after_id=after_id, limit=limit)
+
+    anchor_id = after_id if after_id is not None else before_id
+    anchor = None
+    if anchor_id is not None:
+        anchor = queryset.filter(pk=anchor_id).values_list('created_at', 'id').first()
+        if anchor is None:
+            # cursor points into the archive
+            row = find_archived(room.pk, anchor_id)
+            if row is None:
+                return [], False
+            if after_id is None:
+                rows, has_more = archived_rows(room.pk, before=_key(row), limit=limit)
+                return _messages(room.pk, rows), has_more
+            rows, has_more = archived_rows(room.pk, after=_key(row), limit=limit)
+            messages = _messages(room.pk, rows)
+            remaining = limit - len(messages)
+            # also when the archive filled the page exactly: has_more if hot rows follow
+            if not has_more:
+                hot = list(queryset.order_by('created_at', 'id')[:remaining + 1])
+                has_more = len(hot) > remaining
+                messages += hot[:remaining]
+            return messages, has_more
+
+    messages, has_more = message_page(queryset, before_id=before_id, after_id=after_id, limit=limit)
+    if after_id is None and not has_more:
+        before = (messages[0].created_at, messages[0].id) if messages else anchor
+        rows, has_more = archived_rows(room.pk, before=before, limit=limit - len(messages))
+        messages = _messages(room.pk, rows) + messages
+    return messages, has_more
+
+
+def extend_latest(room, rows, has_more, limit):
+    """Continue a latest page of rows (history_cache.recent_messages) into the archive."""
+    if room.archived_through is None or has_more:
+        return rows, has_more
+    before = _key(rows[0]) if rows else None
+    older, has_more = archived_rows(room.pk, before=before, limit=limit - len(rows))
+    older = [history_cache.message_row(m) for m in _messages(room.pk, older)]
+    return older + rows, has_more
@@ -0,0 +1,229 @@
+"""
+Benchmark data factories and the REST endpoint suite used by
+`manage.py bench_chat_api`.
+
+The factories bulk-insert users, rooms and messages at a configurable scale
+(1k rooms / 1M messages by default) on whatever database the settings point
+at, SQLite or Postgres. Every view in chatapp/urls.py is then called in
+process through DRF's request factory, measuring wall time and SQL query
+count. Query counts are compared against a recorded budget so a change that
+adds queries (an N+1, a lost select_related, ...) fails the run.
+"""
+import json
+import statistics
+import time
+from collections import namedtuple
+from datetime import timedelta
+
+from django.contrib.auth import get_user_model
+from django.contrib.auth.hashers import make_password
+from django.db import connection, transaction
+from django.test.utils import CaptureQueriesContext
+from django.utils import timezone
+from rest_framework.test import APIRequestFactory, force_authenticate
+
+from .models import ChatRoom, Message
+from .utils import record_new_messages
+
+User = get_user_model()
+
+Dataset = namedtuple('Dataset', 'user counterpart room other_rooms')
+Scenario = namedtuple('Scenario', 'name url_name method kwargs data query revalidate')
+Result = namedtuple('Result', 'name status queries median_ms p95_ms')
+
+
+def scenario(name, url_name, method='get', kwargs=None, data=None, query=None, revalidate=False):
+    return Scenario(name, url_name, method, kwargs or {}, data, query or {}, revalidate)
+
+
+# ---------------- Factories ----------------
+def _emails(prefix, kind, count):
+    return [f"{prefix}-{kind}{i}@bench.invalid" for i in range(count)]
+
+
+def _create_users(emails, role, batch_size):
+    password = make_password(None)
+    User.objects.bulk_create(
+        [User(email=email, role=role, password=password) for email in emails],
+        batch_size=batch_size
+    )
+    users = {u.email: u for u in User.objects.filter(email__in=emails)}
+    profile_model = User._meta.get_field('profile').related_model
+    profile_model.objects.bulk_create(
+        [profile_model(user=users[email], first_name=role.title(), last_name=str(i))
+         for i, email in enumerate(emails)],
+        batch_size=batch_size
+    )
+    return [users[email] for email in emails]
+
+
+def build_dataset(prefix='bench', rooms=1000, messages=1_000_000, professionals=10,
+                  batch_size=5000, log=None):
+    """
+    Create (or reuse) a benchmark dataset and return the Dataset to measure.
+
+    `rooms` customers are spread round-robin over `professionals`
+    professionals, so the measured user (the first professional) sits in
+    rooms / professionals rooms. `messages` are split evenly over the rooms,
+    alternating senders, with increasing timestamps, and the rooms' counters
+    and last-message snapshots are maintained exactly as the API does.
+    """
+    log = log or (lambda text: None)
+    professional_emails = _emails(prefix, 'p', professionals)
+    if not User.objects.filter(email=professional_emails[0]).exists():
+        started = time.perf_counter()
+        pros = _create_users(professional_emails, 'professional', batch_size)
+        customers = _create_users(_emails(prefix, 'c', rooms), 'customer', batch_size)
+        ChatRoom.objects.bulk_create(
+            [ChatRoom(customer=c, professional=pros[i % professionals]) for i, c in enumerate(customers)],
+            batch_size=batch_size
+        )
+        room_list = list(ChatRoom.objects.filter(customer__in=customers).select_related('customer', 'professional'))
+        log(f"created {len(pros) + len(customers)} users and {len(room_list)} rooms "
+            f"in {time.perf_counter() - started:.1f}s")
+        _create_messages(room_list, messages, batch_size, log)
+
+    user = User.objects.get(email=professional_emails[0])
+    user_rooms = ChatRoom.objects.filter(professional=user).order_by('-last_message_at', '-id')
+    room = user_rooms.select_related('customer').first()
+    return Dataset(user, room.customer, room, list(user_rooms.exclude(pk=room.pk)[:10]))
+
+
+def _create_messages(rooms, total, batch_size, log):
+    started = time.perf_counter()
+    per_room, extra = divmod(total, len(rooms))
+    base = timezone.now() - timedelta(seconds=total + 60)
+    batch = []
+    created = 0
+
+    def flush():
+        with transaction.atomic():
+            Message.objects.bulk_create(batch)
+            missing = {m.uid: m for m in batch if m.id is None}
+            if missing:
+                for uid, pk in Message.objects.filter(uid__in=missing).values_list('uid', 'id'):
+                    missing[uid].id = pk
+            record_new_messages(batch)
+
+    for index, room in enumerate(rooms):
+        senders = (room.customer, room.professional)
+        for n in range(per_room + (1 if index < extra else 0)):
+            batch.append(Message(
+                room=room, sender=senders[n % 2], content=f"benchmark message {n}",
+                created_at=base + timedelta(seconds=created)
+            ))
+            created += 1
+            if len(batch) >= batch_size:
+                flush()
+                batch = []
+                if created % (batch_size * 20) == 0:
+                    log(f"  {created} messages")
+    if batch:
+        flush()
+    log(f"created {created} messages in {time.perf_counter() - started:.1f}s")
+
+
+# ---------------- Suite ----------------
+def default_scenarios(dataset):
+    """One or more scenarios per view in chatapp/urls.py, reads first, writes last."""
+    room_id = dataset.room.pk
+    latest = dataset.room.last_message_id or 0
+    older = Message.objects.filter(room_id=room_id, id__lt=latest).order_by('-id').values_list('id', flat=True)[100:101]
+    before_id = older[0] if older else latest
+    # messages the measured user received, so marking them read is allowed
+    received = [
+        Message.objects.filter(room=room).exclude(sender=dataset.user).order_by('-id').values_list('id', flat=True).first()
+        for room in dataset.other_rooms or [dataset.room]
+    ]
+    received = [message_id for message_id in received if message_id]
+    return [
+        scenario('rooms', 'chatroom-list-create'),
+        scenario('rooms 304', 'chatroom-list-create', revalidate=True),
+        scenario('room detail', 'chatroom-detail', kwargs={'room_id': room_id}),
+        scenario('room messages latest', 'chatroom-messages', kwargs={'room_id': room_id}),
+        scenario('room messages before_id', 'chatroom-messages', kwargs={'room_id': room_id},
+                 query={'before_id': before_id, 'limit': 50}),
+        scenario('room messages offset', 'chatroom-messages', kwargs={'room_id': room_id},
+                 query={'offset': 100, 'limit': 50}),
+        scenario('room messages 304', 'chatroom-messages', kwargs={'room_id': room_id}, revalidate=True),
+        scenario('unread summary', 'chatroom-unread-summary'),
+        scenario('sync', 'chat-sync'),
+        scenario('messages cursor page', 'message-list-create', query={'limit': 50}),
+        scenario('unread count', 'message-unread-count'),
+        scenario('search', 'message-search', query={'q': 'benchmark message'}),
+        scenario('room start (existing)', 'chatroom-list-create', 'post',
+                 data={'target_user_id': dataset.counterpart.pk}),
+        scenario('send message', 'message-list-create', 'post',
+                 data={'room': room_id, 'content': 'benchmark reply'}),
+        scenario('mark message read', 'message-mark-read', 'patch',
+                 kwargs={'message_id': received[0] if received else latest}),
+        scenario('mark multiple read', 'message-mark-multiple-read', 'post',
+                 data={'message_ids': received}),
+        scenario('mark room read', 'chatroom-mark-read', 'post', kwargs={'room_id': room_id}),
+    ]
+
+
+def _views():
+    from .urls import urlpatterns
+    return {pattern.name: pattern.callback for pattern in urlpatterns}
+
+
+def run_scenario(view, user, spec, iterations):
+    factory = APIRequestFactory()
+    path = f"/bench/{spec.url_name}/"
+    headers = {}
+
+    def call():
+        if spec.method == 'get':
+            request = factory.get(path, spec.query, **headers)
+        else:
+            request = getattr(factory, spec.method)(path, spec.data or {}, format='json', **headers)
+        force_authenticate(request, user=user)
+        response = view(request, **spec.kwargs)
+        if hasattr(response, 'render'):
+            response.render()
+        return response
+
+    if spec.revalidate:
+        headers['HTTP_IF_NONE_MATCH'] = call().get('ETag', '')
+
+    timings, queries, status = [], 0, None
+    for _ in range(iterations):
+        with CaptureQueriesContext(connection) as captured:
+            started = time.perf_counter()
+            response = call()
+            timings.append((time.perf_counter() - started) * 1000)
+        # budget the worst iteration: the first one usually runs against a cold cache
+        queries = max(queries, len(captured))
+        status = response.status_code
+    timings.sort()
+    p95 = timings[min(len(timings) - 1, int(len(timings) * 0.95))]
+    return Result(spec.name, status, queries, statistics.median(timings), p95)
+
+
+def run_suite(dataset, iterations=20, only=None):
+    views = _views()
+    results = []
+    for spec in default_scenarios(dataset):
+        if only and spec.name not in only:
+            continue
+        results.append(run_scenario(views[spec.url_name], dataset.user, spec, iterations))
+    return results
+
+
+def load_budgets(path):
+    try:
+        with open(path) as budgets:
+            return json.load(budgets)
+    except FileNotFoundError:
+        return {}
+
+
+def save_budgets(path, results):
+    with open(path, 'w') as budgets:
+        json.dump({result.name: result.queries for result in results}, budgets, indent=2, sort_keys=True)
+        budgets.write('\n')
+
+
+def over_budget(results, budgets):
+    return [result for result in results if result.name in budgets and result.queries > budgets[result.name]]
@@ -0,0 +1,85 @@
+"""
+Channel-layer group names and fan-out for chat events.
+
+Every room event is delivered to the room group (per-room ChatConsumer
+sockets) and to the participants' user groups (ChatMultiplexConsumer sockets,
+one per user for all of their rooms).
+
+Chat message events carry the client frame already encoded (`frame`), so
+every recipient forwards the same text without rebuilding or re-encoding it.
+When the MessagePack subprotocol is enabled the binary frame (`packed`) is
+encoded once as well, for the sockets that negotiated it (see wire.py).
+
+Frame events are tagged with the app that built them (`origin`); consumers
+drop events from another app whose frames they cannot speak, should the two
+ever share a channel-layer group.
+"""
+from . import encoding, wire
+
+ORIGIN = 'chatapp'
+
+
+def room_group(room_id):
+    return f"chat_{room_id}"
+
+
+def user_group(user_id):
+    return f"chat_user_{user_id}"
+
+
+def room_event_groups(room, exclude_user_id=None):
+    groups = [room_group(room.pk)]
+    for user_id in (room.customer_id, room.professional_id):
+        if user_id is not None and user_id != exclude_user_id:
+            groups.append(user_group(user_id))
+    return groups
+
+
+def message_payload(message, sender):
+    """The chat_message frame clients receive, as a dict."""
+    return {
+        'type': 'chat_message',
+        'room_id': message.room_id,
+        'message': message.content,
+        'user_role': sender.role,
+        'message_id': message.id,
+        'message_uid': str(message.uid),
+        'client_msg_id': message.client_msg_id,
+        'is_read': message.is_read,
+        'created_at': message.created_at.isoformat()
+    }
+
+
+def payload_event(payload):
+    """Channel-layer event for a message payload, encoded once for all recipients."""
+    event = {
+        'type': 'chat_message', 'origin': ORIGIN,
+        'room_id': payload['room_id'], 'frame': encoding.dumps(payload),
+    }
+    if wire.MSGPACK_ENABLED:
+        event['packed'] = wire.pack(payload)
+    return event
+
+
+def message_event(message, sender):
+    return payload_event(message_payload(message, sender))
+
+
+def is_foreign(event, origin=ORIGIN):
+    """True for a frame event tagged by another app; untagged events predate the tag."""
+    return event.get('origin', origin) != origin
+
+
+def event_frame(event):
+    """Text frame of a chat_message event; events from older senders carry bare fields."""
+    frame = event.get('frame')
+    if frame is None:
+        frame = encoding.dumps({
+            'type': 'chat_message', **{key: value for key, value in event.items() if key not in ('type', 'origin')}
+        })
+    return frame
+
+
+async def send_to_room(channel_layer, room, event, exclude_user_id=None):
+    for group in room_event_groups(room, exclude_user_id=exclude_user_id):
+        await channel_layer.group_send(group, event)
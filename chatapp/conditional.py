@@ -0,0 +1,86 @@
+"""
+Conditional GET for polled chat endpoints.
+
+Version tokens are derived from what the payload is built from (room
+`updated_at`, the last message id and participant presence) without loading
+messages or running a serializer, so a poll whose data has not changed is
+answered 304 Not Modified after one small query and one cache round-trip.
+
+Only If-None-Match is honoured. Last-Modified has one-second precision and
+does not cover presence, so an If-Modified-Since alone never yields a 304;
+every response carries the ETag to revalidate with.
+
+Every write that changes a room payload or its message page goes through a
+queryset update that touches `ChatRoom.updated_at` (utils.record_new_messages,
+utils.refresh_unread_counts) or through ChatRoom.save().
+"""
+import hashlib
+
+from django.db.models import Q
+from django.utils.http import http_date, parse_etags, quote_etag
+from rest_framework import status
+from rest_framework.response import Response
+
+from . import presence
+from .models import ChatRoom
+
+
+def _presence_part(user_ids):
+    states = presence.get_many(user_ids)
+    return ','.join(
+        f"{uid}:{int(state['is_online'])}:{state['last_seen'] or ''}"
+        for uid, state in sorted(states.items())
+    )
+
+
+def _token(*parts):
+    return hashlib.md5('|'.join(str(part) for part in parts).encode()).hexdigest()
+
+
+def room_list_version(request):
+    """(etag, last_modified) of `request.user`'s room list."""
+    user = request.user
+    rows = list(ChatRoom.objects.filter(
+        Q(customer=user) | Q(professional=user)
+    ).values_list('id', 'updated_at', 'last_message_id', 'customer_id', 'professional_id'))
+    last_modified = max((row[1] for row in rows), default=None)
+    participants = {uid for row in rows for uid in row[3:]}
+    etag = _token(
+        'rooms', user.id, request.accepted_media_type, len(rows),
+        sum(row[0] for row in rows), last_modified, max((row[2] or 0 for row in rows), default=0),
+        _presence_part(participants)
+    )
+    return etag, last_modified
+
+
+def room_messages_version(request, room):
+    """(etag, last_modified) of a room's message list, for the current query string."""
+    etag = _token(
+        'messages', room.pk, request.user.id, request.accepted_media_type,
+        request.META.get('QUERY_STRING', ''), room.updated_at, room.last_message_id,
+        _presence_part([room.customer_id, room.professional_id])
+    )
+    return etag, room.updated_at
+
+
+def not_modified(request, etag, last_modified):
+    """A 304 response when the client's ETag still matches, else None."""
+    if_none_match = request.META.get('HTTP_IF_NONE_MATCH')
+    if not if_none_match:
+        return None
+    # weak comparison, as for any GET (RFC 7232 section 3.2)
+    tags = parse_etags(if_none_match)
+    matched = '*' in tags or any(tag.removeprefix('W/') == quote_etag(etag) for tag in tags)
+    if not matched:
+        return None
+    return with_validators(Response(status=status.HTTP_304_NOT_MODIFIED), etag, last_modified)
+
+
+def with_validators(response, etag, last_modified):
+    response['ETag'] = f'W/{quote_etag(etag)}'
+    if last_modified is not None:
+        response['Last-Modified'] = http_date(last_modified.timestamp())
+    # always revalidate: the payload carries unread counts and presence
+    response['Cache-Control'] = 'private, no-cache'
+    response['Vary'] = 'Accept, Authorization'
+    return response
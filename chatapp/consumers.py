@@ -1,38 +1,129 @@
 # ...existing code...
-from concurrent.futures import ThreadPoolExecutor
-import json
 import logging
 from channels.generic.websocket import AsyncWebsocketConsumer
-from channels.db import database_sync_to_async
 from django.contrib.auth import get_user_model
 from .models import ChatRoom, Message
-from django.core.exceptions import ObjectDoesNotExist
-from django.contrib.auth.models import AnonymousUser
+from .utils import record_new_message, mark_read_upto
+from .pagination import HISTORY_LIMIT, clamp_limit
+from .presence import presence
+from .persistence import WRITE_BEHIND_ENABLED, writer
+from . import archive, history_cache, receipts
+from .typing_indicator import TypingIndicatorMixin
+from .outbound import OutboundQueueMixin
+from .ratelimit import RateLimitMixin
+from .wire import WireProtocolMixin
+from .executor import db_sync_to_async
+from .dedupe import claim, create_once, normalize_client_msg_id
+from .serializers import ChatRoomSerializer
+from .sync import sync_changes
+from .broadcast import (
+    is_foreign, message_payload, payload_event, room_event_groups, room_group, send_to_room, user_group
+)
+from django.core.serializers.json import DjangoJSONEncoder
+from django.db.models import Max, Q
 
 logger = logging.getLogger(__name__)
 
 User = get_user_model()
-from django.utils import timezone
-from django.core.cache import cache
 
-PRESENCE_TTL = 120
 MAX_MESSAGE_LENGTH = 2000
-HISTORY_LIMIT = 50
 
-class ChatConsumer(AsyncWebsocketConsumer):
+
+# ---------------- Room operations shared by both chat consumers (sync, run on the DB executor) ----------------
+def parse_history_frame(data):
+    """(limit, before_id, after_id) from a history frame; raises TypeError/ValueError."""
+    before_id = int(data['before_id']) if data.get('before_id') else None
+    after_id = int(data['after_id']) if data.get('after_id') else None
+    return clamp_limit(data.get('limit')), before_id, after_id
+
+
+def save_room_message(room, user, content, client_msg_id=None):
+    """Insert a message unless it is a retry of `client_msg_id`; returns (message, created)."""
+    def create():
+        message = Message.objects.create(
+            room=room,
+            sender=user,
+            content=content,
+            client_msg_id=client_msg_id
+        )
+        record_new_message(message)
+        return message
+    return create_once(room, user, client_msg_id, create)
+
+
+async def send_once(room, user, content, client_msg_id=None):
+    """
+    Store a chat message (write-behind when enabled) and return
+    (frame payload, created). A retried client_msg_id gets the original
+    send's payload back with created=False and must not be broadcast again.
+    """
+    if WRITE_BEHIND_ENABLED:
+        # the message gets its uid and timestamp now and is inserted by the batch flusher
+        message = Message(room=room, sender=user, content=content, client_msg_id=client_msg_id)
+        earlier = claim(message) if client_msg_id else None
+        if earlier is not None:
+            return earlier['payload'], False
+        if writer.submit(message):
+            return message_payload(message, user), True
+    # direct insert, also the fallback when the flusher can't take the message
+    message, created = await db_sync_to_async(save_room_message)(room, user, content, client_msg_id)
+    return message_payload(message, message.sender), created
+
+
+def room_history(room, limit=None, before_id=None, after_id=None, with_count=False):
+    if limit is None:
+        limit = HISTORY_LIMIT
+    if before_id is None and after_id is None:
+        # latest page: ring buffer first, database on a miss
+        rows, has_more = history_cache.recent_messages(room.pk, limit)
+        rows, has_more = archive.extend_latest(room, rows, has_more, limit)
+    else:
+        qs = Message.objects.filter(room_id=room.pk).select_related('sender')
+        # chronological order, keyset-paginated on (created_at, id), continued into the archive
+        messages, has_more = archive.room_page(room, qs, before_id=before_id, after_id=after_id, limit=limit)
+        receipts.apply_read_state(messages)
+        rows = [history_cache.message_row(msg) for msg in messages]
+    page = {'has_more': has_more, 'messages': rows}
+    if with_count:
+        page['count'] = Message.objects.filter(room_id=room.pk).count() + archive.archived_count(room)
+    return page
+
+
+def mark_room_messages_read(room_id, user, message_ids, message_uids=()):
+    upto = Message.objects.filter(
+        Q(id__in=message_ids) | Q(uid__in=message_uids),
+        room_id=room_id
+    ).exclude(sender=user).aggregate(upto=Max('id'))['upto']
+    # high-water mark: a single cursor upsert, no per-message writes
+    return mark_read_upto(room_id, user, upto)
+
+
+def is_member(room, user):
+    return room is not None and user.id in (room.customer_id, room.professional_id)
+
+
+class ChatConsumer(WireProtocolMixin, RateLimitMixin, OutboundQueueMixin, TypingIndicatorMixin, AsyncWebsocketConsumer):
     def __init__(self, *args, **kwargs):
         super().__init__(*args, **kwargs)
-        self.executor = ThreadPoolExecutor(max_workers=1)
+        # sync DB helpers run on the process-wide pool in executor.py
+        self.room = None
 
         
     async def connect(self):
         self.room_id = self.scope['url_route']['kwargs']['room_id']
         self.user_id = self.scope['url_route']['kwargs']['user_id']
+        self.room_group_name = room_group(self.room_id)
         self.user = await self._get_user(self.user_id)
         print("this is user",self.user)
-        if self.user is AnonymousUser:
+        if self.user is None:
+            await self.close()
+            return
+        # Room and membership are loaded once per connection and only
+        # reloaded when the room changes (see room_invalidated)
+        self.room = await self.load_room()
+        if self.room is None:
             await self.close()
-        self.room_group_name = f'chat_{self.room_id}'
+            return
         # self.user = self.scope.get('user')
         await self.channel_layer.group_add(
                 self.room_group_name,   
@@ -40,17 +131,24 @@ class ChatConsumer(AsyncWebsocketConsumer):
             )
         
         # check presence before connnect
-        cache.set(f"user:{self.user.id}:online", 1, timeout=PRESENCE_TTL)
-        cache.set(f"user:{self.user.id}:last_seen", timezone.now().isoformat(), timeout=None)
-        await self.accept()
+        presence.touch(self.user.id, immediate=True)
+        # JSON text frames, or MessagePack if the client offers the subprotocol
+        await self.accept_wire()
+        # group events go through a bounded per-connection queue
+        self.start_outbound()
 
  
     async def disconnect(self, close_code):
         # 🔹 Presence: soft offline — only last_seen  updated
         try:
-            cache.set(f"user:{self.user.id}:last_seen", timezone.now().isoformat(), timeout=None)
+            presence.mark_seen(self.user.id)
         except Exception:
             pass
+        try:
+            await self.stop_all_typing()
+        except Exception:
+            logger.exception("Error clearing typing state for room %s", self.room_id)
+        await self.stop_outbound()
         # Leave room group
         try:
             await self.channel_layer.group_discard(
@@ -60,135 +158,351 @@ class ChatConsumer(AsyncWebsocketConsumer):
         except Exception:
             logger.exception("Error discarding group for room %s")
 
-    async def receive(self, text_data):
+    async def receive(self, text_data=None, bytes_data=None):
         try:
-            data = json.loads(text_data)
-        except json.JSONDecodeError:
-            await self.send(text_data=json.dumps({'type': 'error', 'message': 'invalid_json'}))
+            data = self.decode_frame(text_data, bytes_data)
+        except ValueError:
+            if await self.allow_frame():
+                await self.send_frame({'type': 'error', 'message': 'invalid_json'})
+            return
+        message_type = data.get('type', 'chat_message')
+        # typing and ping frames have their own budget (ratelimit.py)
+        if not await self.allow_frame(message_type):
             return
         
         # 🔹 Presence heartbeat (WS)
-        if isinstance(data, dict) and data.get("type") == "ping":
-            cache.set(f"user:{self.user.id}:online", 1, timeout=PRESENCE_TTL)
-            cache.set(f"user:{self.user.id}:last_seen", timezone.now().isoformat(), timeout=None)
+        if message_type == "ping":
+            presence.touch(self.user.id)
             return
 
-        message_type = data.get('type', 'chat_message')
-
         if message_type == 'chat_message':
+            # writes are also charged to the user's budget across connections
+            if not await self.allow_frame_for_user():
+                return
             message_content = (data.get('message') or '').strip()
             if not message_content:
-                await self.send(text_data=json.dumps({'type': 'error', 'message': 'empty_message'}))
+                await self.send_frame({'type': 'error', 'message': 'empty_message'})
+                return
+            try:
+                client_msg_id = normalize_client_msg_id(data.get('client_msg_id'))
+            except ValueError:
+                await self.send_frame({'type': 'error', 'message': 'invalid_client_msg_id'})
                 return
-           
+
             try:
-                message = await self.save_message(message_content)
+                payload, created = await send_once(self.room, self.user, message_content, client_msg_id)
             except Exception:
                 logger.exception("Failed to save message in room %s", self.room_id)
-                await self.send(text_data=json.dumps({'type': 'error', 'message': 'save_failed'}))
+                await self.send_frame({'type': 'error', 'message': 'save_failed'})
                 return
 
-            # Broadcast to group
-            await self.channel_layer.group_send(
-                self.room_group_name,
-                {   
-                    'type': 'chat_message',
-                    'message': message_content,
-                    'user_role': self.user.role,
-                    'message_id': message.id,
-                    'is_read': message.is_read,
-                    'created_at': message.created_at.isoformat()
-                }   
-            )
+            if not created:
+                # retried send: answer the sender only, no second broadcast
+                await self.send_frame({**payload, 'duplicate': True})
+                return
+            # Broadcast to the room group and the participants' multiplexed sockets,
+            # encoded once here rather than once per recipient
+            await send_to_room(self.channel_layer, self.room, payload_event(payload))
+
+        elif message_type == 'typing':
+            # ephemeral: channel layer only, no ORM or cache writes
+            await self.handle_typing(self.room_group_name, data.get('is_typing', True) is not False, room_id=self.room.pk)
+
+        elif message_type == 'history':
+            try:
+                limit, before_id, after_id = parse_history_frame(data)
+            except (TypeError, ValueError):
+                await self.send_frame({'type': 'error', 'message': 'invalid_cursor'})
+                return
+            try:
+                page = await self.get_room_messages(
+                    limit=limit, before_id=before_id, after_id=after_id,
+                    with_count=bool(data.get('include_count'))
+                )
+            except Exception:
+                await self.send_frame({'type': 'error', 'message': 'history_failed'})
+                return
+            await self.send_frame({'type': 'history', **page})
 
         elif message_type == 'mark_read':
             message_ids = data.get('message_ids', [])
-            if not isinstance(message_ids, list):
-                await self.send(text_data=json.dumps({'type': 'error', 'message': 'invalid_message_ids'}))
+            # write-behind clients only know the uid until the row is inserted
+            message_uids = data.get('message_uids', [])
+            if not isinstance(message_ids, list) or not isinstance(message_uids, list):
+                await self.send_frame({'type': 'error', 'message': 'invalid_message_ids'})
                 return
             try:
-                updated = await self.mark_messages_read(message_ids)
-                await self.send(text_data=json.dumps({'type': 'mark_read_ack', 'message_ids': message_ids, 'updated': updated}))
+                updated = await self.mark_messages_read(message_ids, message_uids)
+                await self.send_frame({
+                    'type': 'mark_read_ack', 'message_ids': message_ids,
+                    'message_uids': message_uids, 'updated': updated
+                })
             except Exception:
                 logger.exception("Failed to mark messages read in room %s", self.room_id)
-                await self.send(text_data=json.dumps({'type': 'error', 'message': 'mark_read_failed'}))
+                await self.send_frame({'type': 'error', 'message': 'mark_read_failed'})
 
     async def chat_message(self, event):
-        # Send message to WebSocket
+        if is_foreign(event):
+            return
+        # Forward the frame encoded once by the sender (broadcast.message_event)
         try:
-            await self.send(text_data=json.dumps({
-                'type': 'chat_message',
-                'message': event['message'],
-                'user_role': event['user_role'],
-                'message_id': event['message_id'],
-                'is_read': event['is_read'],
-                'created_at': event['created_at']
-            }))
+            await self.enqueue_frame(**self.event_frame_data(event))
         except Exception:
             logger.exception("Failed to send chat_message to websocket for room %s", self.room_id)
 
-    @database_sync_to_async
-    def verify_room_membership(self):
+    async def message_failed(self, event):
+        # a write-behind message that was broadcast but could not be stored (persistence.py)
+        await self.enqueue_frame(**self.frame_data(dict(event)))
+
+    def typing_groups(self, group):
+        return room_event_groups(self.room, exclude_user_id=self.user.id)
+
+    async def room_invalidated(self, event):
+        # The room was changed or deleted (signals.py): reload it and re-check membership
         try:
-            room = ChatRoom.objects.get(id=self.room_id)
-            # Adjust to your model: support participants M2M or explicit customer/professional fields
-            if hasattr(room, 'participants'):
-                return room.participants.filter(id=self.user.id).exists()
-            return self.user == getattr(room, 'customer', None) or self.user == getattr(room, 'professional', None)
-        except ObjectDoesNotExist:
-            return False
+            room = await self.load_room()
         except Exception:
-            logger.exception("Exception in verify_room_membership for room %s", self.room_id)
-            raise
+            logger.exception("Failed to reload room %s", self.room_id)
+            return
+        if room is None:
+            await self.close()
+            return
+        self.room = room
 
-    @database_sync_to_async
-    def save_message(self, content):
+    @db_sync_to_async
+    def load_room(self):
+        """The connection's room, or None if it doesn't exist or the user isn't a participant."""
         try:
-            room = ChatRoom.objects.get(id=self.room_id)
-
-            message = Message.objects.create(
-                room=room,
-                sender=self.user,
-                content=content
-            )
-            return message
+            room = ChatRoom.objects.filter(id=self.room_id).first()
+            return room if is_member(room, self.user) else None
         except Exception:
-            logger.exception("Exception saving message for room %s and user %s", self.room_id, getattr(self.user, "id", None))
+            logger.exception("Exception in load_room for room %s", self.room_id)
             raise
 
-    @database_sync_to_async
-    def get_room_messages(self, limit=None):
+    @db_sync_to_async
+    def get_room_messages(self, limit=None, before_id=None, after_id=None, with_count=False):
         try:
-            if limit is None:
-                limit = HISTORY_LIMIT
-            qs = Message.objects.filter(room_id=self.room_id).select_related('sender').order_by('-created_at')[:limit]
-            messages = list(reversed(qs))  # chronological order
-            return [{
-                'id': msg.id,
-                'content': msg.content,
-                'sender_id': getattr(msg.sender, 'id', None),
-                'sender_email': getattr(msg.sender, 'email', None),
-                'sender_role': getattr(msg.sender, 'role', None),
-                'is_read': msg.is_read,
-                'created_at': msg.created_at.isoformat()
-            } for msg in messages]
+            return room_history(self.room, limit, before_id, after_id, with_count)
         except Exception:
             logger.exception("Exception fetching messages for room %s", self.room_id)
             raise
 
-    @database_sync_to_async
-    def mark_messages_read(self, message_ids):
+    @db_sync_to_async
+    def mark_messages_read(self, message_ids, message_uids=()):
         try:
-            updated = Message.objects.filter(
-                id__in=message_ids,
-                room_id=self.room_id
-            ).exclude(sender=self.user).update(is_read=True)
-            return updated
+            return mark_room_messages_read(self.room_id, self.user, message_ids, message_uids)
         except Exception:
             logger.exception("Exception marking messages read in room %s", self.room_id)
             raise
 
-    @database_sync_to_async
+    @db_sync_to_async
     def _get_user(self, user_id):
-        return User.objects.get(id=user_id)
-# ...existing code...
\ No newline at end of file
+        return User.objects.filter(id=user_id).first()
+
+
+class ChatMultiplexConsumer(WireProtocolMixin, RateLimitMixin, OutboundQueueMixin, TypingIndicatorMixin, AsyncWebsocketConsumer):
+    """
+    One socket for all of a user's rooms (ws/chat/), instead of one
+    ChatConsumer socket per room. The user is authenticated once by
+    JwtAuthMiddleware (scope['user']); the socket joins the per-user delivery
+    group and carries room-tagged frames:
+
+        {"type": "send", "room_id": 1, "message": "hi"}
+        {"type": "history", "room_id": 1, "before_id": 120, "limit": 50}
+        {"type": "mark_read", "room_id": 1, "message_ids": [118, 119]}
+        {"type": "typing", "room_id": 1, "is_typing": true}
+        {"type": "sync", "since": "<watermark from the last sync>"}
+        {"type": "ping"}
+    """
+
+    async def connect(self):
+        self.user = self.scope.get('user')
+        self.rooms = {}
+        self.user_group_name = None
+        if self.user is None or not self.user.is_authenticated:
+            await self.close()
+            return
+        # all of the user's rooms in one query; rooms created later load on first use
+        self.rooms = await self.load_rooms()
+        self.user_group_name = user_group(self.user.id)
+        await self.channel_layer.group_add(self.user_group_name, self.channel_name)
+
+        presence.touch(self.user.id, immediate=True)
+        await self.accept_wire()
+        self.start_outbound()
+
+    async def disconnect(self, close_code):
+        if self.user_group_name is None:
+            return
+        try:
+            presence.mark_seen(self.user.id)
+            await self.stop_all_typing()
+        except Exception:
+            logger.exception("Error cleaning up multiplexed socket for user %s", self.user.id)
+        await self.stop_outbound()
+        try:
+            await self.channel_layer.group_discard(self.user_group_name, self.channel_name)
+        except Exception:
+            logger.exception("Error discarding group %s", self.user_group_name)
+
+    async def receive(self, text_data=None, bytes_data=None):
+        try:
+            data = self.decode_frame(text_data, bytes_data)
+        except ValueError:
+            if await self.allow_frame():
+                await self.send_error('invalid_json')
+            return
+
+        message_type = data.get('type')
+        if not await self.allow_frame(message_type):
+            return
+        if message_type == 'ping':
+            presence.touch(self.user.id)
+            return
+
+        if message_type == 'sync':
+            try:
+                max_rooms = int(data['max_rooms']) if data.get('max_rooms') else None
+                max_messages = int(data['max_messages']) if data.get('max_messages') else None
+                changes = await self.sync_changes(data.get('since'), max_rooms, max_messages)
+            except (TypeError, ValueError):
+                await self.send_error('invalid_watermark')
+                return
+            except Exception:
+                logger.exception("Failed to sync user %s", self.user.id)
+                await self.send_error('sync_failed')
+                return
+            await self.send_frame({'type': 'sync', **changes}, json_encoder=DjangoJSONEncoder)
+            return
+
+        room = await self.get_member_room(data.get('room_id'))
+        if room is None:
+            await self.send_error('unknown_room', data.get('room_id'))
+            return
+
+        if message_type == 'send':
+            if not await self.allow_frame_for_user():
+                return
+            content = (data.get('message') or '').strip()
+            if not content:
+                await self.send_error('empty_message', room.pk)
+                return
+            try:
+                client_msg_id = normalize_client_msg_id(data.get('client_msg_id'))
+            except ValueError:
+                await self.send_error('invalid_client_msg_id', room.pk)
+                return
+            try:
+                payload, created = await send_once(room, self.user, content, client_msg_id)
+            except Exception:
+                logger.exception("Failed to save message in room %s", room.pk)
+                await self.send_error('save_failed', room.pk)
+                return
+            if not created:
+                await self.send_frame({**payload, 'duplicate': True})
+                return
+            await send_to_room(self.channel_layer, room, payload_event(payload))
+
+        elif message_type == 'history':
+            try:
+                limit, before_id, after_id = parse_history_frame(data)
+                page = await self.get_room_messages(room, limit, before_id, after_id, bool(data.get('include_count')))
+            except (TypeError, ValueError):
+                await self.send_error('invalid_cursor', room.pk)
+                return
+            except Exception:
+                logger.exception("Failed to fetch history for room %s", room.pk)
+                await self.send_error('history_failed', room.pk)
+                return
+            await self.send_frame({'type': 'history', 'room_id': room.pk, **page})
+
+        elif message_type == 'mark_read':
+            message_ids = data.get('message_ids', [])
+            message_uids = data.get('message_uids', [])
+            if not isinstance(message_ids, list) or not isinstance(message_uids, list):
+                await self.send_error('invalid_message_ids', room.pk)
+                return
+            try:
+                updated = await self.mark_messages_read(room.pk, message_ids, message_uids)
+            except Exception:
+                logger.exception("Failed to mark messages read in room %s", room.pk)
+                await self.send_error('mark_read_failed', room.pk)
+                return
+            await self.send_frame({
+                'type': 'mark_read_ack', 'room_id': room.pk, 'message_ids': message_ids,
+                'message_uids': message_uids, 'updated': updated
+            })
+
+        elif message_type == 'typing':
+            await self.handle_typing(room_group(room.pk), data.get('is_typing', True) is not False, room_id=room.pk)
+
+        else:
+            await self.send_error('unknown_type', room.pk)
+
+    async def chat_message(self, event):
+        if is_foreign(event):
+            return
+        await self.enqueue_frame(**self.event_frame_data(event))
+
+    async def room_invalidated(self, event):
+        room_id = event['room_id']
+        self.rooms.pop(room_id, None)
+        try:
+            await self.get_member_room(room_id)
+        except Exception:
+            logger.exception("Failed to reload room %s", room_id)
+
+    async def message_failed(self, event):
+        # a write-behind message that was broadcast but could not be stored (persistence.py)
+        await self.enqueue_frame(**self.frame_data(dict(event)))
+
+    def typing_groups(self, group):
+        room = self.rooms.get(int(group.rsplit('_', 1)[1]))
+        return room_event_groups(room, exclude_user_id=self.user.id) if room else [group]
+
+    async def send_error(self, code, room_id=None):
+        frame = {'type': 'error', 'message': code}
+        if room_id is not None:
+            frame['room_id'] = room_id
+        await self.send_frame(frame)
+
+    async def get_member_room(self, room_id):
+        try:
+            room_id = int(room_id)
+        except (TypeError, ValueError):
+            return None
+        room = self.rooms.get(room_id)
+        if room is None:
+            room = await self.load_room(room_id)
+            if room is not None:
+                self.rooms[room_id] = room
+        return room
+
+    @db_sync_to_async
+    def sync_changes(self, since, max_rooms=None, max_messages=None):
+        rooms, messages, watermark, has_more = sync_changes(self.user, since, max_rooms, max_messages)
+        # rooms this socket knows about are refreshed from the same rows
+        for room in rooms:
+            if room.pk in self.rooms:
+                self.rooms[room.pk] = room
+        serializer = ChatRoomSerializer(rooms, many=True, context={'user': self.user})
+        return {'rooms': serializer.data, 'messages': messages, 'watermark': watermark, 'has_more': has_more}
+
+    @db_sync_to_async
+    def load_rooms(self):
+        rooms = ChatRoom.objects.filter(Q(customer=self.user) | Q(professional=self.user))
+        return {room.pk: room for room in rooms}
+
+    @db_sync_to_async
+    def load_room(self, room_id):
+        room = ChatRoom.objects.filter(id=room_id).first()
+        return room if is_member(room, self.user) else None
+
+    @db_sync_to_async
+    def get_room_messages(self, room, limit=None, before_id=None, after_id=None, with_count=False):
+        return room_history(room, limit, before_id, after_id, with_count)
+
+    @db_sync_to_async
+    def mark_messages_read(self, room_id, message_ids, message_uids=()):
+        return mark_room_messages_read(room_id, self.user, message_ids, message_uids)
+# ...existing code...
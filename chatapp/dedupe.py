@@ -0,0 +1,96 @@
+"""
+Idempotent message sends with client-supplied dedupe keys.
+
+A client may tag a send (REST post or WebSocket chat_message frame) with a
+`client_msg_id`. A retry with the same key, room and sender gets the original
+message back instead of a second insert and broadcast:
+
+- a short-lived cache entry per key (CHAT_CLIENT_MSG_ID_TTL seconds) answers
+  retries inside the usual retry window without any write;
+- the partial unique constraint on (room, sender, client_msg_id) is the
+  guarantee: a retry that misses the cache loses the insert race and is
+  answered with the stored original.
+"""
+from functools import partial
+
+from django.conf import settings
+from django.core.cache import cache
+from django.db import IntegrityError, transaction
+
+from . import metrics
+from .broadcast import message_payload
+from .models import Message
+
+CLIENT_MSG_ID_TTL = getattr(settings, 'CHAT_CLIENT_MSG_ID_TTL', 300)
+MAX_CLIENT_MSG_ID_LENGTH = 64
+
+
+def normalize_client_msg_id(value):
+    """The client's dedupe key as a string, or None; raises ValueError when unusable."""
+    if value is None or value == '':
+        return None
+    if not isinstance(value, (str, int)) or isinstance(value, bool):
+        raise ValueError("client_msg_id must be a string")
+    value = str(value).strip()
+    if not value or len(value) > MAX_CLIENT_MSG_ID_LENGTH:
+        raise ValueError(f"client_msg_id must be 1-{MAX_CLIENT_MSG_ID_LENGTH} characters")
+    return value
+
+
+def dedupe_key(room_id, sender_id, client_msg_id):
+    return f"chat:dedupe:{room_id}:{sender_id}:{client_msg_id}"
+
+
+def _entry(message):
+    # the frame payload lets WebSocket retries be answered from the cache alone
+    return {'id': message.id, 'uid': str(message.uid), 'payload': message_payload(message, message.sender)}
+
+
+def recent(room_id, sender_id, client_msg_id):
+    return cache.get(dedupe_key(room_id, sender_id, client_msg_id))
+
+
+def remember(message):
+    cache.set(dedupe_key(message.room_id, message.sender_id, message.client_msg_id), _entry(message), CLIENT_MSG_ID_TTL)
+
+
+def claim(message):
+    """
+    Reserve the key of an unsaved (write-behind) message. Returns None when
+    this send owns the key, else the cache entry of the earlier send.
+    """
+    key = dedupe_key(message.room_id, message.sender_id, message.client_msg_id)
+    if cache.add(key, _entry(message), CLIENT_MSG_ID_TTL):
+        return None
+    return cache.get(key)
+
+
+def stored_original(room_id, sender_id, client_msg_id):
+    return Message.objects.select_related('sender').filter(
+        room_id=room_id, sender_id=sender_id, client_msg_id=client_msg_id
+    ).first()
+
+
+def create_once(room, sender, client_msg_id, create):
+    """
+    Run `create()` (which saves the message and its bookkeeping) unless this
+    send is a retry. Returns (message, created).
+    """
+    if client_msg_id is None:
+        return create(), True
+    if recent(room.pk, sender.id, client_msg_id) is not None:
+        original = stored_original(room.pk, sender.id, client_msg_id)
+        if original is not None:
+            metrics.incr('dedupe.cache_hit')
+            return original, False
+    try:
+        with transaction.atomic():
+            message = create()
+    except IntegrityError:
+        original = stored_original(room.pk, sender.id, client_msg_id)
+        if original is None:
+            raise
+        metrics.incr('dedupe.conflict')
+        return original, False
+    transaction.on_commit(partial(remember, message))
+    return message, True
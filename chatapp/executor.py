@@ -0,0 +1,55 @@
+"""
+Process-wide bounded executor for the chat consumers' synchronous DB helpers.
+
+Consumers used to create a ThreadPoolExecutor per WebSocket connection. Now
+every consumer shares one pool of CHAT_DB_EXECUTOR_WORKERS threads, which also
+caps the number of DB connections the WebSocket workers open. The pool is
+created lazily and shut down from the ASGI lifespan handler (see lifespan.py)
+or at interpreter exit.
+"""
+import atexit
+import functools
+import threading
+from concurrent.futures import ThreadPoolExecutor
+
+from channels.db import database_sync_to_async
+from django.conf import settings
+
+DB_EXECUTOR_WORKERS = getattr(settings, 'CHAT_DB_EXECUTOR_WORKERS', 8)
+
+_executor = None
+_lock = threading.Lock()
+
+
+def get_executor():
+    global _executor
+    if _executor is None:
+        with _lock:
+            if _executor is None:
+                _executor = ThreadPoolExecutor(max_workers=DB_EXECUTOR_WORKERS, thread_name_prefix='chat-db')
+    return _executor
+
+
+def shutdown(wait=True):
+    global _executor
+    with _lock:
+        executor, _executor = _executor, None
+    if executor is not None:
+        executor.shutdown(wait=wait)
+
+
+def db_sync_to_async(func):
+    """
+    Like channels' database_sync_to_async (old connections are closed around
+    each call), but runs on the shared bounded pool instead of asgiref's
+    single thread-sensitive thread.
+    """
+    @functools.wraps(func)
+    async def wrapper(*args, **kwargs):
+        return await database_sync_to_async(
+            func, thread_sensitive=False, executor=get_executor()
+        )(*args, **kwargs)
+    return wrapper
+
+
+atexit.register(shutdown)
@@ -0,0 +1,219 @@
+"""
+Per-room ring buffer of the most recent messages, kept in the shared cache.
+
+Opening a room almost always asks for the latest page, so the last
+CHAT_RECENT_MESSAGES_SIZE messages of each room are cached as serialized rows.
+Buffers are filled from the database on a miss, appended to after commit when
+messages are saved (utils.record_new_messages) and invalidated when read state
+changes. Works with any Django cache backend (locmem, Redis, ...).
+
+Buffered rows carry everything the REST serializer renders: the sender's
+profile and the read state as of the buffer's version, so a hit is rebuilt
+into Message instances without touching the database. Profile edits show up
+once the buffer is next refilled (at the latest after its TTL).
+"""
+import logging
+
+from django.conf import settings
+from django.contrib.auth import get_user_model
+from django.core.cache import cache
+from django.utils.dateparse import parse_datetime
+
+from . import metrics, receipts
+from .models import Message
+from .pagination import message_page
+
+logger = logging.getLogger(__name__)
+
+User = get_user_model()
+
+RECENT_MESSAGES_SIZE = getattr(settings, 'CHAT_RECENT_MESSAGES_SIZE', 50)
+RECENT_MESSAGES_TTL = getattr(settings, 'CHAT_RECENT_MESSAGES_TTL', 60 * 60)
+
+
+def recent_key(room_id):
+    return f"chat:room:{room_id}:recent"
+
+
+def version_key(room_id):
+    return f"chat:room:{room_id}:recent:version"
+
+
+_NOT_LOADED = object()
+
+
+def _profile_relation():
+    descriptor = getattr(User, 'profile', None)
+    return getattr(descriptor, 'related', None)
+
+
+def _loaded_profile(sender):
+    """The sender's profile (or None) if it is already loaded, else _NOT_LOADED; never queries."""
+    relation = _profile_relation()
+    if sender is None or relation is None or not relation.is_cached(sender):
+        return _NOT_LOADED
+    return relation.get_cached_value(sender)
+
+
+def message_row(message, sender=None):
+    sender = sender or message.sender
+    row = {
+        'id': message.id,
+        'uid': str(message.uid),
+        'client_msg_id': message.client_msg_id,
+        'content': message.content,
+        'sender_id': getattr(sender, 'id', None),
+        'sender_email': getattr(sender, 'email', None),
+        'sender_role': getattr(sender, 'role', None),
+        'is_read': message.is_read,
+        'created_at': message.created_at.isoformat()
+    }
+    profile = _loaded_profile(sender)
+    if profile is not _NOT_LOADED:
+        row['sender_profile'] = None if profile is None else {
+            'first_name': profile.first_name,
+            'last_name': profile.last_name,
+            'profile_pic': profile.profile_pic.name or None,
+        }
+    return row
+
+
+def _bump_version(room_id):
+    key = version_key(room_id)
+    cache.add(key, 0, timeout=None)
+    try:
+        return cache.incr(key)
+    except ValueError:
+        # evicted between add and incr
+        cache.set(key, 1, timeout=None)
+        return 1
+
+
+def recent_messages(room_id, limit):
+    """
+    Latest `limit` messages of a room as rows, oldest first, plus has_more.
+    Served from the ring buffer when possible, otherwise from the database
+    (which also refills the buffer).
+
+    Every write bumps a per-room version; a buffer is only trusted when it
+    carries the current version, so concurrent fills and appends can never
+    serve a buffer that misses a message.
+    """
+    queryset = Message.objects.filter(room_id=room_id).select_related('sender__profile')
+    if limit > RECENT_MESSAGES_SIZE:
+        metrics.incr('history_cache.bypass')
+        messages, has_more = message_page(queryset, limit=limit)
+        receipts.apply_read_state(messages)
+        return [message_row(m) for m in messages], has_more
+
+    found = cache.get_many([recent_key(room_id), version_key(room_id)])
+    version = found.get(version_key(room_id), 0)
+    buffer = found.get(recent_key(room_id))
+
+    if buffer is not None and buffer['version'] == version:
+        metrics.incr('history_cache.hit')
+    else:
+        metrics.incr('history_cache.miss')
+        messages, has_more = message_page(queryset, limit=RECENT_MESSAGES_SIZE)
+        receipts.apply_read_state(messages)
+        buffer = {
+            'rows': [message_row(m) for m in messages],
+            # the buffer holds the room's entire history
+            'complete': not has_more,
+            'version': version,
+        }
+        cache.set(recent_key(room_id), buffer, timeout=RECENT_MESSAGES_TTL)
+
+    rows = buffer['rows']
+    has_more = len(rows) > limit or not buffer['complete']
+    return rows[-limit:], has_more
+
+
+def push(room_id, messages):
+    """Append freshly saved messages to the room's buffer if it is current."""
+    try:
+        version = _bump_version(room_id)
+        buffer = cache.get(recent_key(room_id))
+        if buffer is None or buffer['version'] != version - 1:
+            # missing or already stale; the next read refills it
+            return
+        # a refill that ran after commit but before this push already has them
+        buffered = {row['id'] for row in buffer['rows']}
+        messages = [m for m in messages if m.id not in buffered]
+        if not messages:
+            buffer['version'] = version
+            cache.set(recent_key(room_id), buffer, timeout=RECENT_MESSAGES_TTL)
+            return
+        # one query per write so that reads never need one
+        sender_ids = {m.sender_id for m in messages if _loaded_profile(m.sender) is _NOT_LOADED}
+        senders = User.objects.select_related('profile').in_bulk(sender_ids) if sender_ids else {}
+        rows = buffer['rows'] + [message_row(m, senders.get(m.sender_id)) for m in messages]
+        rows.sort(key=lambda row: (row['created_at'], row['id']))
+        if len(rows) > RECENT_MESSAGES_SIZE:
+            rows = rows[-RECENT_MESSAGES_SIZE:]
+            buffer['complete'] = False
+        buffer['rows'] = rows
+        buffer['version'] = version
+        cache.set(recent_key(room_id), buffer, timeout=RECENT_MESSAGES_TTL)
+        metrics.incr('history_cache.push', len(messages))
+    except Exception:
+        logger.exception("Failed to append to recent-message buffer for room %s", room_id)
+
+
+def invalidate(room_ids):
+    """Mark the buffers of `room_ids` stale (e.g. after read state changed)."""
+    room_ids = set(room_ids)
+    for room_id in room_ids:
+        _bump_version(room_id)
+    if room_ids:
+        metrics.incr('history_cache.invalidate', len(room_ids))
+
+
+def _row_sender(row):
+    """Unsaved sender (with its profile) rebuilt from a row that carries the profile."""
+    sender = User(id=row['sender_id'], email=row['sender_email'], role=row['sender_role'])
+    relation = _profile_relation()
+    profile = row['sender_profile']
+    if profile is not None:
+        profile = relation.related_model(user=sender, **profile)
+    relation.set_cached_value(sender, profile)
+    return sender
+
+
+def rows_to_messages(room_id, rows, read_state_current=False):
+    """
+    Rebuild unsaved Message instances from cached rows so the regular
+    MessageSerializer can render them. Senders come from the rows when they
+    carry the profile, otherwise they are loaded in one query. With
+    `read_state_current` the rows' is_read is trusted (ring buffer rows are
+    invalidated whenever read state changes) instead of re-derived from the
+    read cursors.
+    """
+    senders = {}
+    missing = set()
+    for row in rows:
+        sender_id = row['sender_id']
+        if sender_id is None or sender_id in senders:
+            continue
+        if 'sender_profile' in row and _profile_relation() is not None:
+            senders[sender_id] = _row_sender(row)
+        else:
+            missing.add(sender_id)
+    if missing:
+        senders.update(User.objects.select_related('profile').in_bulk(missing))
+
+    messages = []
+    for row in rows:
+        message = Message(
+            id=row['id'],
+            uid=row['uid'],
+            client_msg_id=row.get('client_msg_id'),
+            room_id=room_id,
+            sender=senders.get(row['sender_id']),
+            content=row['content'],
+            is_read=row['is_read'],
+            created_at=parse_datetime(row['created_at']),
+        )
+        message._read_state_applied = read_state_current
+        messages.append(message)
+    return messages
@@ -0,0 +1,46 @@
+"""
+ASGI lifespan handler that shuts the chat subsystems down cleanly.
+
+Route the "lifespan" protocol to it in asgi.py:
+
+    application = ProtocolTypeRouter({
+        "http": django_asgi_app,
+        "websocket": ...,
+        "lifespan": ChatLifespanApp(),
+    })
+
+On shutdown it drains the write-behind message queue, flushes buffered
+presence and stops the shared DB executor, in that order (the first two still
+need the executor's database access to be possible).
+"""
+import logging
+
+from asgiref.sync import sync_to_async
+
+logger = logging.getLogger(__name__)
+
+
+def shutdown_chat():
+    from . import executor
+    from .persistence import writer
+    from .presence import presence
+
+    for name, hook in (('write-behind', writer.shutdown), ('presence', presence.flush), ('executor', executor.shutdown)):
+        try:
+            hook()
+        except Exception:
+            logger.exception("Error shutting down chat %s", name)
+
+
+class ChatLifespanApp:
+    async def __call__(self, scope, receive, send):
+        if scope['type'] != 'lifespan':
+            raise ValueError(f"ChatLifespanApp cannot handle {scope['type']!r}")
+        while True:
+            message = await receive()
+            if message['type'] == 'lifespan.startup':
+                await send({'type': 'lifespan.startup.complete'})
+            elif message['type'] == 'lifespan.shutdown':
+                await sync_to_async(shutdown_chat, thread_sensitive=False)()
+                await send({'type': 'lifespan.shutdown.complete'})
+                return
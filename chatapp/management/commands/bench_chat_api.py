@@ -0,0 +1,54 @@
+from pathlib import Path
+
+from django.core.management.base import BaseCommand, CommandError
+
+from apps.chatapp import benchmarks
+
+DEFAULT_BUDGETS = Path(benchmarks.__file__).with_name('query_budgets.json')
+
+
+class Command(BaseCommand):
+    help = "Benchmark every chatapp REST view (wall time and SQL queries) against a generated dataset"
+
+    def add_arguments(self, parser):
+        parser.add_argument('--rooms', type=int, default=1000)
+        parser.add_argument('--messages', type=int, default=1_000_000)
+        parser.add_argument('--professionals', type=int, default=10, help='Rooms are spread round-robin over this many professionals')
+        parser.add_argument('--prefix', default='bench', help='Email prefix of the generated users; an existing dataset is reused')
+        parser.add_argument('--batch-size', type=int, default=5000)
+        parser.add_argument('--iterations', type=int, default=20)
+        parser.add_argument('--only', nargs='*', help='Scenario names to run')
+        parser.add_argument('--budgets', default=str(DEFAULT_BUDGETS), help='JSON file of per-scenario query budgets')
+        parser.add_argument('--record', action='store_true', help='Write the measured query counts as the new budgets')
+
+    def handle(self, *args, **options):
+        budgets = benchmarks.load_budgets(options['budgets'])
+        if not budgets and not options['record']:
+            raise CommandError(f"No query budgets in {options['budgets']}; run with --record to create them")
+        dataset = benchmarks.build_dataset(
+            prefix=options['prefix'], rooms=options['rooms'], messages=options['messages'],
+            professionals=options['professionals'], batch_size=options['batch_size'], log=self.stdout.write
+        )
+        results = benchmarks.run_suite(dataset, iterations=options['iterations'], only=options['only'])
+
+        self.stdout.write(f"{'scenario':<26} {'status':>6} {'queries':>8} {'budget':>7} {'median ms':>10} {'p95 ms':>8}")
+        for result in results:
+            budget = budgets.get(result.name, '-')
+            self.stdout.write(
+                f"{result.name:<26} {result.status:>6} {result.queries:>8} {budget:>7} "
+                f"{result.median_ms:>10.2f} {result.p95_ms:>8.2f}"
+            )
+
+        errors = [result.name for result in results if result.status >= 400]
+        if errors:
+            raise CommandError(f"Scenarios returned an error status: {', '.join(errors)}")
+        if options['record']:
+            benchmarks.save_budgets(options['budgets'], results)
+            self.stdout.write(self.style.SUCCESS(f"Recorded query budgets in {options['budgets']}"))
+            return
+        exceeded = benchmarks.over_budget(results, budgets)
+        if exceeded:
+            raise CommandError("Query budget exceeded: " + ', '.join(
+                f"{result.name} ({result.queries} > {budgets[result.name]})" for result in exceeded
+            ))
+        self.stdout.write(self.style.SUCCESS("All scenarios within their query budgets"))
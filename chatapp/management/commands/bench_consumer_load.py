@@ -0,0 +1,179 @@
+import asyncio
+import json
+import threading
+import time
+
+from channels.layers import channel_layers
+from channels.routing import URLRouter
+from channels.testing import WebsocketCommunicator
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connections
+from django.db.backends.signals import connection_created
+from django.test import override_settings
+
+from apps.chatapp import executor, metrics
+from apps.chatapp.management.commands.bench_consumer_threads import process_stats
+from apps.chatapp.models import ChatRoom
+from apps.chatapp.persistence import writer
+from apps.chatapp.routing import websocket_urlpatterns
+
+WRITE_STATEMENTS = ('INSERT', 'UPDATE', 'DELETE')
+
+
+class WriteCounter:
+    """Counts INSERT/UPDATE/DELETE statements on every DB connection, including executor threads."""
+
+    def __init__(self):
+        self.writes = 0
+        self._lock = threading.Lock()
+
+    def __call__(self, execute, sql, params, many, context):
+        if sql.lstrip()[:6].upper() in WRITE_STATEMENTS:
+            with self._lock:
+                self.writes += 1
+        return execute(sql, params, many, context)
+
+    def install(self, connection, **kwargs):
+        if self not in connection.execute_wrappers:
+            connection.execute_wrappers.append(self)
+
+    def __enter__(self):
+        connection_created.connect(self.install)
+        for connection in connections.all():
+            self.install(connection)
+        return self
+
+    def __exit__(self, *exc_info):
+        connection_created.disconnect(self.install)
+        for connection in connections.all():
+            if self in connection.execute_wrappers:
+                connection.execute_wrappers.remove(self)
+
+
+class Client:
+    def __init__(self, communicator, room_id):
+        self.communicator = communicator
+        self.room_id = room_id
+        self.latencies = []
+        self.errors = 0
+
+
+class Command(BaseCommand):
+    help = "Drive simulated ChatConsumer clients across rooms and report delivery latency, DB writes and memory"
+
+    def add_arguments(self, parser):
+        parser.add_argument('--rooms', type=int, default=100, help='Number of existing rooms to load (most recently active first)')
+        parser.add_argument('--clients-per-room', type=int, default=20)
+        parser.add_argument('--rate', type=float, default=2.0, help='Messages per second sent into each room')
+        parser.add_argument('--duration', type=float, default=10.0, help='Seconds to send for')
+        parser.add_argument('--drain', type=float, default=3.0, help='Seconds to wait for in-flight deliveries')
+        parser.add_argument('--layer', choices=['memory', 'redis'], default='memory')
+        parser.add_argument('--redis-url', default='redis://127.0.0.1:6379/0')
+
+    def handle(self, *args, **options):
+        rooms = list(
+            ChatRoom.objects.filter(customer__isnull=False, professional__isnull=False)
+            .order_by('-updated_at')[:options['rooms']]
+        )
+        if not rooms:
+            raise CommandError('Need chat rooms with both participants (see bench_chat_api to generate some)')
+
+        if options['layer'] == 'redis':
+            layer = {'BACKEND': 'channels_redis.core.RedisChannelLayer', 'CONFIG': {'hosts': [options['redis_url']]}}
+        else:
+            layer = {'BACKEND': 'channels.layers.InMemoryChannelLayer', 'CONFIG': {'capacity': 10000}}
+        with override_settings(CHANNEL_LAYERS={'default': layer}):
+            channel_layers.backends.clear()
+            try:
+                asyncio.run(self.run(rooms, options))
+            finally:
+                channel_layers.backends.clear()
+
+    async def run(self, rooms, options):
+        application = URLRouter(websocket_urlpatterns)
+        per_room = options['clients_per_room']
+        _, baseline_rss = process_stats()
+
+        started = time.perf_counter()
+        clients_by_room = {}
+        for room in rooms:
+            clients = clients_by_room[room.id] = []
+            for n in range(per_room):
+                # alternate participants; each user may hold many sockets
+                user_id = room.customer_id if n % 2 == 0 else room.professional_id
+                communicator = WebsocketCommunicator(application, f"/ws/chat/{user_id}/{room.id}/")
+                connected, _ = await communicator.connect(timeout=30)
+                if not connected:
+                    raise CommandError(f"Connection to room {room.id} as user {user_id} was rejected")
+                clients.append(Client(communicator, room.id))
+        all_clients = [client for clients in clients_by_room.values() for client in clients]
+        threads, connected_rss = process_stats()
+        self.stdout.write(f"opened {len(all_clients)} connections across {len(rooms)} rooms "
+                          f"in {time.perf_counter() - started:.2f}s ({threads} threads)")
+
+        stop = asyncio.Event()
+        readers = [asyncio.ensure_future(self.read(client, stop)) for client in all_clients]
+        metrics.reset()
+        with WriteCounter() as counter:
+            sent = await asyncio.gather(*(
+                self.drive(clients, options['rate'], options['duration']) for clients in clients_by_room.values()
+            ))
+            await asyncio.sleep(options['drain'])
+            # write-behind batches still queued count towards the messages that caused them
+            await asyncio.get_running_loop().run_in_executor(None, writer.shutdown)
+            stop.set()
+            await asyncio.gather(*readers)
+            writes = counter.writes
+
+        await asyncio.gather(*(client.communicator.disconnect() for client in all_clients))
+        executor.shutdown()
+        self.report(all_clients, sum(sent), per_room, options['duration'], writes,
+                    (connected_rss - baseline_rss) / len(all_clients))
+
+    async def drive(self, clients, rate, duration):
+        """Send into one room at `rate`/s, rotating senders so no socket trips its own rate limit."""
+        interval = 1.0 / rate
+        deadline = time.perf_counter() + duration
+        sent = 0
+        # stagger rooms so sends don't all land on the same tick
+        await asyncio.sleep(interval * (clients[0].room_id % 100) / 100)
+        while time.perf_counter() < deadline:
+            sender = clients[sent % len(clients)]
+            await sender.communicator.send_to(text_data=json.dumps({
+                'type': 'chat_message', 'message': f"load {time.perf_counter():.9f}"
+            }))
+            sent += 1
+            await asyncio.sleep(interval)
+        return sent
+
+    async def read(self, client, stop):
+        while not stop.is_set():
+            try:
+                text = await client.communicator.receive_from(timeout=0.5)
+            except asyncio.TimeoutError:
+                continue
+            received_at = time.perf_counter()
+            frame = json.loads(text)
+            if frame.get('type') == 'chat_message' and str(frame.get('message', '')).startswith('load '):
+                client.latencies.append(received_at - float(frame['message'].split()[1]))
+            elif frame.get('type') == 'error':
+                client.errors += 1
+
+    def report(self, clients, sent, per_room, duration, writes, rss_per_connection):
+        latencies = sorted(latency for client in clients for latency in client.latencies)
+        expected = sent * per_room
+        errors = sum(client.errors for client in clients)
+
+        def percentile(p):
+            return latencies[min(len(latencies) - 1, int(len(latencies) * p))] * 1000 if latencies else float('nan')
+
+        self.stdout.write(f"sent: {sent} messages ({sent / duration:.1f} msg/s)")
+        self.stdout.write(f"delivered: {len(latencies)} of {expected} expected frames "
+                          f"({len(latencies) / duration:.1f} frames/s), {errors} error frames")
+        self.stdout.write(f"delivery latency: p50={percentile(0.5):.2f} ms p99={percentile(0.99):.2f} ms "
+                          f"max={percentile(1.0):.2f} ms")
+        self.stdout.write(f"db writes: {writes} ({writes / sent if sent else 0:.2f} per message)")
+        self.stdout.write(f"memory: {rss_per_connection * 1024:.1f} KiB per connection")
+        counters = metrics.snapshot()['counters']
+        if counters:
+            self.stdout.write("metrics: " + ', '.join(f"{name}={value}" for name, value in sorted(counters.items())))
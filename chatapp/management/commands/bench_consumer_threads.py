@@ -0,0 +1,75 @@
+import asyncio
+import resource
+import threading
+import time
+
+from channels.layers import channel_layers
+from channels.routing import URLRouter
+from channels.testing import WebsocketCommunicator
+from django.core.management.base import BaseCommand, CommandError
+from django.test import override_settings
+
+from apps.chatapp import executor
+from apps.chatapp.models import ChatRoom
+from apps.chatapp.routing import websocket_urlpatterns
+
+
+def process_stats():
+    """Live thread count and resident memory (MiB) of this process."""
+    try:
+        with open('/proc/self/statm') as statm:
+            rss = int(statm.read().split()[1]) * resource.getpagesize()
+    except OSError:
+        # ru_maxrss is the peak, in KiB on Linux (bytes on macOS)
+        rss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss * 1024
+    return threading.active_count(), rss / (1024 * 1024)
+
+
+class Command(BaseCommand):
+    help = "Open N fake ChatConsumer connections and report thread count and RSS"
+
+    def add_arguments(self, parser):
+        parser.add_argument('--connections', type=int, default=1000)
+        parser.add_argument('--room-id', type=int, help='Room to connect to (defaults to the most recently active room)')
+        parser.add_argument('--history', action='store_true', help='Request one history page per connection to exercise the DB helpers')
+
+    def handle(self, *args, **options):
+        room = ChatRoom.objects.filter(pk=options['room_id']).first() if options['room_id'] else \
+            ChatRoom.objects.order_by('-updated_at').first()
+        if room is None or room.customer_id is None:
+            raise CommandError('Need a chat room with a customer to connect as')
+
+        layers = {'default': {'BACKEND': 'channels.layers.InMemoryChannelLayer'}}
+        with override_settings(CHANNEL_LAYERS=layers):
+            channel_layers.backends.clear()
+            asyncio.run(self.run(room, options['connections'], options['history']))
+        channel_layers.backends.clear()
+
+    async def run(self, room, count, history):
+        application = URLRouter(websocket_urlpatterns)
+        path = f"/ws/chat/{room.customer_id}/{room.id}/"
+        self.report('baseline', *process_stats())
+
+        started = time.perf_counter()
+        clients = []
+        for _ in range(count):
+            communicator = WebsocketCommunicator(application, path)
+            connected, _ = await communicator.connect()
+            if not connected:
+                raise CommandError(f"Connection {len(clients) + 1} was rejected")
+            clients.append(communicator)
+        self.stdout.write(f"opened {count} connections in {time.perf_counter() - started:.2f}s")
+
+        if history:
+            await asyncio.gather(*(c.send_json_to({'type': 'history', 'limit': 10}) for c in clients))
+            await asyncio.gather(*(c.receive_json_from(timeout=30) for c in clients))
+        self.report(f'{count} open', *process_stats())
+
+        await asyncio.gather(*(c.disconnect() for c in clients))
+        self.report('after disconnect', *process_stats())
+
+        executor.shutdown()
+        self.report('after executor shutdown', *process_stats())
+
+    def report(self, label, threads, rss_mib):
+        self.stdout.write(f"{label:>24}: threads={threads:<6} rss={rss_mib:.1f} MiB")
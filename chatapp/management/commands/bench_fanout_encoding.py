@@ -0,0 +1,80 @@
+import json
+import time
+import uuid
+
+from django.core.management.base import BaseCommand
+from django.utils import timezone
+
+from apps.chatapp import encoding
+from apps.chatapp.broadcast import event_frame
+
+
+def sample_payload():
+    return {
+        'type': 'chat_message',
+        'room_id': 4242,
+        'message': "Hi, I can come by on Thursday afternoon to have a look at the leak - does 3pm work?",
+        'user_role': 'professional',
+        'message_id': 9876543,
+        'message_uid': str(uuid.uuid4()),
+        'client_msg_id': str(uuid.uuid4()),
+        'is_read': False,
+        'created_at': timezone.now().isoformat(),
+    }
+
+
+class Command(BaseCommand):
+    help = "Measure CPU spent encoding one chat broadcast for N recipients: per-recipient json.dumps vs encode-once"
+
+    def add_arguments(self, parser):
+        parser.add_argument('--recipients', type=int, default=1000)
+        parser.add_argument('--iterations', type=int, default=200)
+
+    def handle(self, *args, **options):
+        recipients = options['recipients']
+        iterations = options['iterations']
+        payload = sample_payload()
+        fields = {key: value for key, value in payload.items() if key != 'type'}
+
+        def per_recipient():
+            # what every receiving consumer used to do with a bare-field event
+            event = {'type': 'chat_message', **fields}
+            for _ in range(recipients):
+                json.dumps({
+                    'type': 'chat_message',
+                    'message': event['message'],
+                    'user_role': event['user_role'],
+                    'message_id': event['message_id'],
+                    'message_uid': event.get('message_uid'),
+                    'client_msg_id': event.get('client_msg_id'),
+                    'is_read': event['is_read'],
+                    'created_at': event['created_at']
+                })
+
+        def encode_once(dumps):
+            def run():
+                event = {'type': 'chat_message', 'room_id': payload['room_id'], 'frame': dumps(payload)}
+                for _ in range(recipients):
+                    event_frame(event)
+            return run
+
+        cases = [('per-recipient json.dumps', per_recipient), ('encode once (json)', encode_once(encoding.get_encoder('json')))]
+        if encoding.orjson is not None:
+            cases.append(('encode once (orjson)', encode_once(encoding.get_encoder('orjson'))))
+        else:
+            self.stdout.write("orjson is not installed; skipping the orjson case")
+
+        baseline = None
+        self.stdout.write(f"{recipients} recipients, {iterations} broadcasts, CPU time per broadcast:")
+        for label, run in cases:
+            run()  # warm up
+            started = time.process_time()
+            for _ in range(iterations):
+                run()
+            cpu_us = (time.process_time() - started) / iterations * 1e6
+            if baseline is None:
+                baseline = cpu_us
+                self.stdout.write(f"  {label:<26} {cpu_us:>10.1f} µs")
+            else:
+                saved = baseline - cpu_us
+                self.stdout.write(f"  {label:<26} {cpu_us:>10.1f} µs  (saves {saved:.1f} µs, {saved / baseline:.0%})")
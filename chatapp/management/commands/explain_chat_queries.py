@@ -0,0 +1,72 @@
+from django.core.management.base import BaseCommand, CommandError
+from django.db.models import Count, F, Q
+
+from apps.chatapp.models import ChatRoom, Message, RoomReadCursor
+from apps.chatapp.receipts import get_read_cursor, unread_messages
+from apps.chatapp.pagination import HISTORY_LIMIT
+
+
+class Command(BaseCommand):
+    help = "Run EXPLAIN on the ORM queries used by the chat views and consumer to check index usage"
+
+    def add_arguments(self, parser):
+        parser.add_argument('--room-id', type=int, help='Room to explain against (defaults to the most recently active room)')
+        parser.add_argument('--user-id', type=int, help='Participant to explain against (defaults to the room customer)')
+        parser.add_argument('--analyze', action='store_true', help='Use EXPLAIN ANALYZE (executes the queries)')
+
+    def handle(self, *args, **options):
+        room = self._get_room(options['room_id'])
+        user_id = options['user_id'] or room.customer_id or room.professional_id
+        user_rooms = ChatRoom.objects.filter(Q(customer_id=user_id) | Q(professional_id=user_id))
+        older_ids = Message.objects.filter(room=room).order_by('-created_at', '-id').values_list('id', flat=True)
+        anchor = next(iter(older_ids[HISTORY_LIMIT:HISTORY_LIMIT + 1]), None)
+        timeline = Message.objects.filter(room=room).select_related('sender')
+        cursor = get_read_cursor(room.id, user_id)
+
+        queries = [
+            ('room list (ChatRoomListCreateAPIView.get)',
+             user_rooms.select_related('customer__profile', 'professional__profile', 'last_message_sender')
+             .order_by(F('last_message_at').desc(nulls_last=True), '-updated_at')),
+            ('room timeline, latest page (ChatRoomMessagesAPIView / ChatConsumer.get_room_messages)',
+             timeline.order_by('-created_at', '-id')[:HISTORY_LIMIT + 1]),
+            ('room count (include_count)',
+             Message.objects.filter(room=room).order_by()),
+            ('read cursor lookup (receipts.get_read_cursor)',
+             RoomReadCursor.objects.filter(room=room, user_id=user_id).values('last_read_message_id')),
+            ('unread range above cursor (mark_read_upto / refresh_unread_counts)',
+             unread_messages(room.id, user_id, cursor).order_by().values('room').annotate(total=Count('id')).values('total')),
+            ('read state for a page (receipts.apply_read_state)',
+             RoomReadCursor.objects.filter(room_id__in=[room.id]).values_list('room_id', 'user_id', 'last_read_message_id')),
+            ('unread per user (MessageUnreadCountAPIView)',
+             user_rooms.values('id', 'customer_unread_count', 'professional_unread_count')),
+            ('all messages for user (MessageListCreateAPIView.get)',
+             Message.objects.filter(Q(room__customer_id=user_id) | Q(room__professional_id=user_id))
+             .select_related('sender__profile').order_by('-created_at', '-id')),
+        ]
+
+        for title, queryset in queries:
+            self._explain(title, queryset, options['analyze'])
+
+        if anchor is not None:
+            # message_page resolves the anchor first; explain the page query it then runs
+            created_at = Message.objects.filter(pk=anchor).values_list('created_at', flat=True).first()
+            older = timeline.filter(Q(created_at__lt=created_at) | Q(created_at=created_at, id__lt=anchor))
+            self._explain('room timeline, before_id cursor', older.order_by('-created_at', '-id')[:HISTORY_LIMIT + 1], options['analyze'])
+
+    def _get_room(self, room_id):
+        rooms = ChatRoom.objects.all()
+        room = rooms.filter(pk=room_id).first() if room_id else rooms.order_by('-updated_at').first()
+        if room is None:
+            raise CommandError('No chat room found to explain against')
+        return room
+
+    def _explain(self, title, queryset, analyze):
+        self.stdout.write(self.style.MIGRATE_HEADING(title))
+        try:
+            plan = queryset.explain(analyze=analyze) if analyze else queryset.explain()
+        except Exception as exc:
+            self.stdout.write(self.style.ERROR(f"  EXPLAIN failed: {exc}"))
+            return
+        for line in plan.splitlines():
+            self.stdout.write(f"  {line}")
+        self.stdout.write('')
@@ -0,0 +1,33 @@
+from django.core.management.base import BaseCommand
+from django.db import transaction
+
+from apps.chatapp import search
+from apps.chatapp.models import Message, MessageSearchTerm
+
+
+class Command(BaseCommand):
+    help = "Rebuild the message search inverted index (databases without Postgres full-text search)"
+
+    def add_arguments(self, parser):
+        parser.add_argument('--batch-size', type=int, default=2000)
+
+    def handle(self, *args, **options):
+        if search.uses_postgres():
+            self.stdout.write("Postgres serves search from the GIN index of migration 0009; nothing to rebuild")
+            return
+        MessageSearchTerm.objects.all().delete()
+        batch = []
+        indexed = 0
+        messages = Message.objects.filter(room__isnull=False).only('id', 'room_id', 'content').order_by('id')
+        for message in messages.iterator(chunk_size=options['batch_size']):
+            batch.append(message)
+            if len(batch) >= options['batch_size']:
+                with transaction.atomic():
+                    search.index_messages(batch)
+                indexed += len(batch)
+                batch = []
+        if batch:
+            with transaction.atomic():
+                search.index_messages(batch)
+            indexed += len(batch)
+        self.stdout.write(self.style.SUCCESS(f"Indexed {indexed} messages"))
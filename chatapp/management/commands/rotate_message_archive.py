@@ -0,0 +1,26 @@
+from django.core.management.base import BaseCommand
+
+from apps.chatapp import archive
+
+
+class Command(BaseCommand):
+    help = "Move whole months of messages older than the retention window from the hot table into the archive"
+
+    def add_arguments(self, parser):
+        parser.add_argument('--months', type=int, default=archive.ARCHIVE_AFTER_MONTHS,
+                            help='Months of messages to keep in the hot table (default: CHAT_ARCHIVE_AFTER_MONTHS)')
+        parser.add_argument('--dry-run', action='store_true', help='Only list the months that would be archived')
+
+    def handle(self, *args, **options):
+        months = archive.archivable_months(options['months'])
+        if not months:
+            self.stdout.write("Nothing to archive")
+            return
+        for month in months:
+            if options['dry_run']:
+                self.stdout.write(f"would archive {month:%Y-%m}")
+                continue
+            moved = archive.archive_month(month)
+            self.stdout.write(f"archived {month:%Y-%m}: {moved} messages")
+        if not options['dry_run']:
+            self.stdout.write(self.style.SUCCESS(f"Archived {len(months)} month(s)"))
@@ -0,0 +1,38 @@
+"""
+Process-local counters and gauges for the chat subsystems.
+
+Cheap enough to call on hot paths (a dict update under a lock); export them
+with snapshot() from a health/metrics endpoint or a periodic log line.
+"""
+import threading
+from collections import Counter
+
+_lock = threading.Lock()
+_counters = Counter()
+_gauges = {}
+
+
+def incr(name, value=1):
+    with _lock:
+        _counters[name] += value
+
+
+def gauge(name, value):
+    with _lock:
+        _gauges[name] = value
+
+
+def gauge_add(name, delta):
+    with _lock:
+        _gauges[name] = _gauges.get(name, 0) + delta
+
+
+def snapshot():
+    with _lock:
+        return {'counters': dict(_counters), 'gauges': dict(_gauges)}
+
+
+def reset():
+    with _lock:
+        _counters.clear()
+        _gauges.clear()
@@ -45,28 +45,22 @@ class JwtAuthMiddleware:
             scope['user'] = await get_user_from_token(token)
         return await self.app(scope, receive, send)
 
-from django.utils import timezone
-from django.core.cache import cache
+from .presence import presence
 
 
 # ---------------- Presence based on ANY API activity ----------------
 class PresenceActivityMiddleware:
     """
     any authenticated HTTP API get request  update their pesence
+    (buffered: see presence.PresenceBuffer, TTL is CHAT_PRESENCE_TTL = 120s by default)
     """
     def __init__(self, get_response):
         self.get_response = get_response
-        # 120s good default (API hit no hit ২ minutes offline)
-        self.ACTIVITY_TTL = 120
 
     def __call__(self, request):
         response = self.get_response(request)
 
         user = getattr(request, "user", None)
         if user and user.is_authenticated:
-            now_iso = timezone.now().isoformat()
-            cache.set(f"user:{user.id}:online", 1, timeout=self.ACTIVITY_TTL)
-            cache.set(f"user:{user.id}:last_seen", now_iso, timeout=None)
+            presence.touch(user.id)
         return response
-    
-    
\ No newline at end of file
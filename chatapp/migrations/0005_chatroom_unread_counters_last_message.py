@@ -0,0 +1,73 @@
+# Generated by Django 5.2.5 on 2026-10-17 10:00
+
+import django.db.models.deletion
+from django.conf import settings
+from django.db import migrations, models
+
+
+def backfill_room_state(apps, schema_editor):
+    ChatRoom = apps.get_model('chatapp', 'ChatRoom')
+    Message = apps.get_model('chatapp', 'Message')
+
+    for room in ChatRoom.objects.all().iterator():
+        unread = Message.objects.filter(room_id=room.id, is_read=False)
+        room.customer_unread_count = unread.exclude(sender_id=room.customer_id).count()
+        room.professional_unread_count = unread.exclude(sender_id=room.professional_id).count()
+
+        last = Message.objects.filter(room_id=room.id).order_by('-created_at', '-id').first()
+        if last is not None:
+            room.last_message_id = last.id
+            room.last_message_preview = last.content[:255]
+            room.last_message_sender_id = last.sender_id
+            room.last_message_at = last.created_at
+
+        ChatRoom.objects.filter(pk=room.pk).update(
+            customer_unread_count=room.customer_unread_count,
+            professional_unread_count=room.professional_unread_count,
+            last_message_id=room.last_message_id,
+            last_message_preview=room.last_message_preview,
+            last_message_sender_id=room.last_message_sender_id,
+            last_message_at=room.last_message_at,
+        )
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('chatapp', '0004_alter_chatroom_customer_alter_chatroom_professional_and_more'),
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='chatroom',
+            name='customer_unread_count',
+            field=models.PositiveIntegerField(default=0),
+        ),
+        migrations.AddField(
+            model_name='chatroom',
+            name='professional_unread_count',
+            field=models.PositiveIntegerField(default=0),
+        ),
+        migrations.AddField(
+            model_name='chatroom',
+            name='last_message_id',
+            field=models.BigIntegerField(blank=True, null=True),
+        ),
+        migrations.AddField(
+            model_name='chatroom',
+            name='last_message_preview',
+            field=models.CharField(blank=True, default='', max_length=255),
+        ),
+        migrations.AddField(
+            model_name='chatroom',
+            name='last_message_sender',
+            field=models.ForeignKey(blank=True, null=True, on_delete=django.db.models.deletion.SET_NULL, related_name='+', to=settings.AUTH_USER_MODEL),
+        ),
+        migrations.AddField(
+            model_name='chatroom',
+            name='last_message_at',
+            field=models.DateTimeField(blank=True, null=True),
+        ),
+        migrations.RunPython(backfill_room_state, migrations.RunPython.noop),
+    ]
@@ -0,0 +1,45 @@
+# Generated by Django 5.2.5 on 2026-10-17 11:00
+
+import uuid
+
+import django.utils.timezone
+from django.db import migrations, models
+
+
+def fill_message_uids(apps, schema_editor):
+    Message = apps.get_model('chatapp', 'Message')
+    batch = []
+    for message in Message.objects.filter(uid__isnull=True).only('id').iterator(chunk_size=2000):
+        message.uid = uuid.uuid4()
+        batch.append(message)
+        if len(batch) >= 2000:
+            Message.objects.bulk_update(batch, ['uid'])
+            batch = []
+    if batch:
+        Message.objects.bulk_update(batch, ['uid'])
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('chatapp', '0006_message_indexes'),
+    ]
+
+    operations = [
+        migrations.AlterField(
+            model_name='message',
+            name='created_at',
+            field=models.DateTimeField(default=django.utils.timezone.now, editable=False),
+        ),
+        migrations.AddField(
+            model_name='message',
+            name='uid',
+            field=models.UUIDField(editable=False, null=True),
+        ),
+        migrations.RunPython(fill_message_uids, migrations.RunPython.noop),
+        migrations.AlterField(
+            model_name='message',
+            name='uid',
+            field=models.UUIDField(default=uuid.uuid4, editable=False, unique=True),
+        ),
+    ]
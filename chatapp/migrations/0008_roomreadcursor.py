@@ -0,0 +1,90 @@
+# Generated by Django 5.2.5 on 2026-10-17 12:00
+
+import django.db.models.deletion
+from django.conf import settings
+from django.db import migrations, models
+from django.db.models import Count, Max, OuterRef, Subquery, Value
+from django.db.models.functions import Coalesce
+
+
+def cursors_from_is_read(apps, schema_editor):
+    """Seed each participant's cursor with the newest message they had marked read."""
+    ChatRoom = apps.get_model('chatapp', 'ChatRoom')
+    Message = apps.get_model('chatapp', 'Message')
+    RoomReadCursor = apps.get_model('chatapp', 'RoomReadCursor')
+
+    cursors = []
+    for room in ChatRoom.objects.all().iterator():
+        for user_id in (room.customer_id, room.professional_id):
+            if user_id is None:
+                continue
+            upto = Message.objects.filter(room_id=room.id, is_read=True).exclude(
+                sender_id=user_id
+            ).aggregate(upto=Max('id'))['upto']
+            if upto:
+                cursors.append(RoomReadCursor(room_id=room.id, user_id=user_id, last_read_message_id=upto))
+        if len(cursors) >= 1000:
+            RoomReadCursor.objects.bulk_create(cursors, ignore_conflicts=True)
+            cursors = []
+    if cursors:
+        RoomReadCursor.objects.bulk_create(cursors, ignore_conflicts=True)
+
+
+def unread_counts_from_cursors(apps, schema_editor):
+    """
+    Recount the denormalized unread counters from the seeded cursors (as
+    utils.refresh_unread_counts does), so they agree with `id > cursor` even
+    where an unread message sat below a later read one.
+    """
+    ChatRoom = apps.get_model('chatapp', 'ChatRoom')
+    Message = apps.get_model('chatapp', 'Message')
+    RoomReadCursor = apps.get_model('chatapp', 'RoomReadCursor')
+
+    for side in ('customer', 'professional'):
+        cursor = Coalesce(Subquery(
+            RoomReadCursor.objects.filter(room=OuterRef(OuterRef('pk')), user=OuterRef(OuterRef(side)))
+            .values('last_read_message_id')[:1]
+        ), Value(0))
+        unread = Coalesce(Subquery(
+            Message.objects.filter(room=OuterRef('pk'), id__gt=cursor)
+            .exclude(sender=OuterRef(side))
+            .order_by()
+            .values('room')
+            .annotate(total=Count('id'))
+            .values('total')[:1]
+        ), Value(0))
+        ChatRoom.objects.filter(**{f'{side}__isnull': False}).update(**{f'{side}_unread_count': unread})
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('chatapp', '0007_message_uid_created_at_default'),
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='RoomReadCursor',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('last_read_message_id', models.BigIntegerField(default=0)),
+                ('updated_at', models.DateTimeField(auto_now=True)),
+                ('room', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='read_cursors', to='chatapp.chatroom')),
+                ('user', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='+', to=settings.AUTH_USER_MODEL)),
+            ],
+            options={
+                'unique_together': {('room', 'user')},
+            },
+        ),
+        migrations.RunPython(cursors_from_is_read, migrations.RunPython.noop),
+        migrations.RunPython(unread_counts_from_cursors, migrations.RunPython.noop),
+        migrations.RemoveIndex(
+            model_name='message',
+            name='chat_msg_room_unread_idx',
+        ),
+        migrations.AddIndex(
+            model_name='message',
+            index=models.Index(fields=['room', 'id'], name='chat_msg_room_id_idx'),
+        ),
+    ]
@@ -0,0 +1,45 @@
+# Generated by Django 5.2.5 on 2026-10-17 12:00
+
+import django.db.models.deletion
+from django.db import migrations, models
+
+SEARCH_CONFIG = 'simple'
+
+
+def create_gin_index(apps, schema_editor):
+    if schema_editor.connection.vendor != 'postgresql':
+        return
+    # must match the expression in search.py for the planner to use it
+    schema_editor.execute(
+        "CREATE INDEX IF NOT EXISTS chat_msg_content_fts_idx ON chatapp_message "
+        f"USING GIN (to_tsvector('{SEARCH_CONFIG}', content))"
+    )
+
+
+def drop_gin_index(apps, schema_editor):
+    if schema_editor.connection.vendor != 'postgresql':
+        return
+    schema_editor.execute("DROP INDEX IF EXISTS chat_msg_content_fts_idx")
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('chatapp', '0008_roomreadcursor'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='MessageSearchTerm',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('term', models.CharField(max_length=64)),
+                ('message', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='+', to='chatapp.message')),
+                ('room', models.ForeignKey(db_index=False, on_delete=django.db.models.deletion.CASCADE, related_name='+', to='chatapp.chatroom')),
+            ],
+            options={
+                'indexes': [models.Index(fields=['term', 'room', 'message'], name='chat_search_term_idx')],
+            },
+        ),
+        migrations.RunPython(create_gin_index, drop_gin_index),
+    ]
@@ -1,5 +1,8 @@
+import uuid
+
 from django.db import models
 from django.conf import settings
+from django.utils import timezone
 
 class ChatRoom(models.Model):
     customer = models.ForeignKey(
@@ -17,6 +20,22 @@ class ChatRoom(models.Model):
     created_at = models.DateTimeField(auto_now_add=True)
     updated_at = models.DateTimeField(auto_now=True)
 
+    # Denormalized per-participant unread counters (maintained in utils.py)
+    customer_unread_count = models.PositiveIntegerField(default=0)
+    professional_unread_count = models.PositiveIntegerField(default=0)
+
+    # Snapshot of the latest message so room lists never touch the messages table
+    last_message_id = models.BigIntegerField(null=True, blank=True)
+    last_message_preview = models.CharField(max_length=255, blank=True, default='')
+    last_message_sender = models.ForeignKey(
+        settings.AUTH_USER_MODEL,
+        on_delete=models.SET_NULL, null=True, blank=True,
+        related_name='+'
+    )
+    last_message_at = models.DateTimeField(null=True, blank=True)
+    # Messages created before this moment live in MessageArchive (see archive.py)
+    archived_through = models.DateTimeField(null=True, blank=True)
+
     class Meta:
         unique_together = ['customer', 'professional']
         ordering = ['-updated_at']
@@ -24,16 +43,102 @@ class ChatRoom(models.Model):
     def __str__(self):
         return f"Chat: {self.customer.email} - {self.professional.email}"
 
+    def unread_field_for(self, user):
+        """Name of the unread counter column belonging to `user` in this room."""
+        if user is not None and self.customer_id == user.id:
+            return 'customer_unread_count'
+        return 'professional_unread_count'
+
+    def unread_count_for(self, user):
+        return getattr(self, self.unread_field_for(user))
+
 
 class Message(models.Model):
     room = models.ForeignKey(ChatRoom, on_delete=models.SET_NULL,null=True, related_name='messages')
     sender = models.ForeignKey(settings.AUTH_USER_MODEL, on_delete=models.SET_NULL, null=True)
     content = models.TextField()
+    # Legacy flag, no longer written: read state comes from RoomReadCursor
+    # (see receipts.apply_read_state), which still fills this in API output
     is_read = models.BooleanField(default=False)
-    created_at = models.DateTimeField(auto_now_add=True)
+    # Assigned in Python (not auto_now_add) so write-behind batches keep the
+    # timestamp clients were shown when the message was broadcast
+    created_at = models.DateTimeField(default=timezone.now, editable=False)
+    # Client-visible id available before the row is inserted
+    uid = models.UUIDField(default=uuid.uuid4, unique=True, editable=False)
+    # Optional client dedupe key: retried sends return the original (see dedupe.py)
+    client_msg_id = models.CharField(max_length=64, null=True, blank=True)
 
     class Meta:
         ordering = ['created_at']
+        indexes = [
+            # Room timeline: history pages, keyset cursors, last-message lookups
+            models.Index(fields=['room', 'created_at', 'id'], name='chat_msg_room_timeline_idx'),
+            # Unread ranges above a read cursor: room_id = X AND id > cursor
+            models.Index(fields=['room', 'id'], name='chat_msg_room_id_idx'),
+        ]
+        constraints = [
+            models.UniqueConstraint(
+                fields=['room', 'sender', 'client_msg_id'],
+                condition=models.Q(client_msg_id__isnull=False),
+                name='chat_msg_client_msg_id_uniq'
+            ),
+        ]
 
     def __str__(self):
         return f"{self.sender.email}: {self.content[:50]}"
+
+
+class RoomReadCursor(models.Model):
+    """Newest message a participant has read in a room (high-water mark)."""
+    room = models.ForeignKey(ChatRoom, on_delete=models.CASCADE, related_name='read_cursors')
+    user = models.ForeignKey(settings.AUTH_USER_MODEL, on_delete=models.CASCADE, related_name='+')
+    last_read_message_id = models.BigIntegerField(default=0)
+    updated_at = models.DateTimeField(auto_now=True)
+
+    class Meta:
+        unique_together = ['room', 'user']
+
+    def __str__(self):
+        return f"Room {self.room_id} read by {self.user_id} up to {self.last_read_message_id}"
+
+
+class MessageSearchTerm(models.Model):
+    """
+    Inverted-index posting (term -> message) for message search on databases
+    without built-in full-text search; Postgres uses a GIN index instead.
+    Maintained by search.index_messages.
+    """
+    term = models.CharField(max_length=64)
+    room = models.ForeignKey(ChatRoom, on_delete=models.CASCADE, related_name='+', db_index=False)
+    message = models.ForeignKey(Message, on_delete=models.CASCADE, related_name='+')
+
+    class Meta:
+        indexes = [
+            # term lookups scoped to the caller's rooms, newest message first
+            models.Index(fields=['term', 'room', 'message'], name='chat_search_term_idx'),
+        ]
+
+    def __str__(self):
+        return f"{self.term} -> {self.message_id}"
+
+
+class MessageArchive(models.Model):
+    """
+    One month of a room's messages moved out of the hot Message table:
+    zlib-compressed JSON rows in the history_cache.message_row format.
+    Written by archive.archive_month, read back by the history endpoints.
+    """
+    room = models.ForeignKey(ChatRoom, on_delete=models.CASCADE, related_name='archives')
+    month = models.DateField()
+    first_id = models.BigIntegerField()
+    last_id = models.BigIntegerField()
+    first_created_at = models.DateTimeField()
+    last_created_at = models.DateTimeField()
+    message_count = models.PositiveIntegerField()
+    payload = models.BinaryField()
+
+    class Meta:
+        unique_together = ['room', 'month']
+
+    def __str__(self):
+        return f"Room {self.room_id} {self.month:%Y-%m} ({self.message_count} messages)"
@@ -0,0 +1,120 @@
+"""
+Bounded per-connection outbound queue for chat consumers.
+
+Group events are queued on the connection and written to the socket by a
+drain task, so a slow client only backs up its own queue instead of the
+worker's event loop and the channel layer. When the queue is full the
+CHAT_OUTBOUND_OVERFLOW policy applies:
+
+- "drop_oldest": drop the oldest queued frame
+- "coalesce":    replace a queued frame with the same coalesce key (typing,
+                 presence...), otherwise drop the oldest coalescible frame,
+                 otherwise the oldest frame
+- "disconnect":  close the connection as a slow consumer
+"""
+import asyncio
+import logging
+from collections import deque
+
+from django.conf import settings
+
+from . import metrics
+
+logger = logging.getLogger(__name__)
+
+OUTBOUND_QUEUE_SIZE = getattr(settings, 'CHAT_OUTBOUND_QUEUE_SIZE', 256)
+OUTBOUND_OVERFLOW = getattr(settings, 'CHAT_OUTBOUND_OVERFLOW', 'drop_oldest')
+SLOW_CONSUMER_CLOSE_CODE = 4008
+
+DROP_OLDEST = 'drop_oldest'
+COALESCE = 'coalesce'
+DISCONNECT = 'disconnect'
+
+
+class OutboundQueueMixin:
+    """
+    Mix into an AsyncWebsocketConsumer: call start_outbound() after accept(),
+    stop_outbound() from disconnect(), and enqueue_frame() instead of send()
+    for fan-out traffic.
+    """
+    outbound_queue_size = OUTBOUND_QUEUE_SIZE
+    outbound_overflow = OUTBOUND_OVERFLOW
+
+    def start_outbound(self):
+        self._outbound = deque()
+        self._outbound_ready = asyncio.Event()
+        self._outbound_closed = False
+        self.outbound_dropped = 0
+        self._outbound_task = asyncio.ensure_future(self._drain_outbound())
+
+    async def stop_outbound(self):
+        task = getattr(self, '_outbound_task', None)
+        if task is None:
+            return
+        self._outbound_closed = True
+        task.cancel()
+        try:
+            await task
+        except asyncio.CancelledError:
+            pass
+        metrics.gauge_add('outbound.queue_depth', -len(self._outbound))
+        self._outbound.clear()
+        self._outbound_task = None
+
+    async def enqueue_frame(self, text_data=None, bytes_data=None, coalesce_key=None):
+        if getattr(self, '_outbound_task', None) is None:
+            # not started (or already stopped): plain send
+            if not getattr(self, '_outbound_closed', False):
+                await self.send(text_data=text_data, bytes_data=bytes_data)
+            return
+        if self._outbound_closed:
+            return
+
+        queue = self._outbound
+        if coalesce_key is not None and self.outbound_overflow == COALESCE:
+            for index, (key, _, _) in enumerate(queue):
+                if key == coalesce_key:
+                    queue[index] = (coalesce_key, text_data, bytes_data)
+                    metrics.incr('outbound.coalesced')
+                    return
+
+        if len(queue) >= self.outbound_queue_size:
+            if self.outbound_overflow == DISCONNECT:
+                await self._disconnect_slow_consumer()
+                return
+            self._drop_one(queue)
+
+        queue.append((coalesce_key, text_data, bytes_data))
+        metrics.gauge_add('outbound.queue_depth', 1)
+        self._outbound_ready.set()
+
+    def _drop_one(self, queue):
+        victim = 0
+        if self.outbound_overflow == COALESCE:
+            victim = next((i for i, (key, _, _) in enumerate(queue) if key is not None), 0)
+        del queue[victim]
+        self.outbound_dropped += 1
+        metrics.incr('outbound.dropped')
+        metrics.gauge_add('outbound.queue_depth', -1)
+
+    async def _disconnect_slow_consumer(self):
+        logger.warning("Closing slow consumer %s with %s queued frames", self.channel_name, len(self._outbound))
+        metrics.incr('outbound.slow_disconnects')
+        metrics.incr('outbound.dropped', len(self._outbound))
+        metrics.gauge_add('outbound.queue_depth', -len(self._outbound))
+        self._outbound.clear()
+        self._outbound_closed = True
+        await self.close(code=SLOW_CONSUMER_CLOSE_CODE)
+
+    async def _drain_outbound(self):
+        while True:
+            await self._outbound_ready.wait()
+            while self._outbound:
+                _, text_data, bytes_data = self._outbound.popleft()
+                metrics.gauge_add('outbound.queue_depth', -1)
+                try:
+                    await self.send(text_data=text_data, bytes_data=bytes_data)
+                    metrics.incr('outbound.sent')
+                except Exception:
+                    logger.exception("Failed to write queued frame to %s", self.channel_name)
+            self._outbound_ready.clear()
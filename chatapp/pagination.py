@@ -0,0 +1,42 @@
+from django.db.models import Q
+
+HISTORY_LIMIT = 50
+MAX_HISTORY_LIMIT = 200
+
+
+def clamp_limit(limit, default=HISTORY_LIMIT):
+    if limit is None:
+        return default
+    return max(1, min(int(limit), MAX_HISTORY_LIMIT))
+
+
+def message_page(queryset, before_id=None, after_id=None, limit=HISTORY_LIMIT):
+    """
+    Keyset pagination over a message queryset on (created_at, id).
+
+    - no cursor: the latest `limit` messages
+    - before_id: the `limit` messages older than that message (scroll-back)
+    - after_id: the `limit` messages newer than that message (catch-up)
+
+    Returns (messages in chronological order, has_more). Cost depends only on
+    `limit`, never on how deep into the history the cursor points. A cursor
+    outside `queryset` (e.g. a message of another room) gives an empty page.
+    """
+    anchor_id = after_id if after_id is not None else before_id
+    if anchor_id is not None:
+        anchor = queryset.filter(pk=anchor_id).values_list('created_at', flat=True).first()
+        if anchor is None:
+            return [], False
+        if after_id is not None:
+            queryset = queryset.filter(Q(created_at__gt=anchor) | Q(created_at=anchor, id__gt=anchor_id))
+        else:
+            queryset = queryset.filter(Q(created_at__lt=anchor) | Q(created_at=anchor, id__lt=anchor_id))
+
+    if after_id is not None:
+        rows = list(queryset.order_by('created_at', 'id')[:limit + 1])
+        has_more = len(rows) > limit
+        return rows[:limit], has_more
+
+    rows = list(queryset.order_by('-created_at', '-id')[:limit + 1])
+    has_more = len(rows) > limit
+    return list(reversed(rows[:limit])), has_more
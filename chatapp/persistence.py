@@ -0,0 +1,208 @@
+"""
+Opt-in write-behind persistence for WebSocket chat messages.
+
+With CHAT_WRITE_BEHIND = True the consumer builds the Message in memory
+(its `uid` and `created_at` are known immediately), broadcasts it, and hands
+it to the per-process MessageWriteBehind flusher. The flusher inserts queued
+messages with bulk_create in batches of up to CHAT_WRITE_BEHIND_BATCH_SIZE,
+waiting at most CHAT_WRITE_BEHIND_MAX_LATENCY seconds for a batch to fill.
+
+Queued messages are drained on graceful shutdown (atexit, or an explicit
+shutdown() from the ASGI lifespan handler).
+
+Rows that still fail after the batch retries and the row-by-row fallback go
+to a dead-letter list and are retried every CHAT_WRITE_BEHIND_DEAD_LETTER_INTERVAL
+seconds, up to CHAT_WRITE_BEHIND_DEAD_LETTER_RETRIES times. A message that is
+finally given up on was already broadcast, so its room gets a
+`message_failed` event (clients drop it by uid) and its client_msg_id is
+released for a fresh send.
+"""
+import atexit
+import logging
+import queue
+import threading
+import time
+
+from asgiref.sync import async_to_sync
+from channels.layers import get_channel_layer
+from django.conf import settings
+from django.core.cache import cache
+from django.db import close_old_connections, transaction
+
+from .broadcast import room_event_groups
+from .dedupe import dedupe_key
+from .models import ChatRoom, Message
+from .utils import record_new_messages
+
+logger = logging.getLogger(__name__)
+
+WRITE_BEHIND_ENABLED = getattr(settings, 'CHAT_WRITE_BEHIND', False)
+WRITE_BEHIND_BATCH_SIZE = getattr(settings, 'CHAT_WRITE_BEHIND_BATCH_SIZE', 200)
+WRITE_BEHIND_MAX_LATENCY = getattr(settings, 'CHAT_WRITE_BEHIND_MAX_LATENCY', 0.25)
+WRITE_BEHIND_QUEUE_SIZE = getattr(settings, 'CHAT_WRITE_BEHIND_QUEUE_SIZE', 10000)
+WRITE_BEHIND_RETRIES = 3
+DEAD_LETTER_INTERVAL = getattr(settings, 'CHAT_WRITE_BEHIND_DEAD_LETTER_INTERVAL', 30.0)
+DEAD_LETTER_RETRIES = getattr(settings, 'CHAT_WRITE_BEHIND_DEAD_LETTER_RETRIES', 5)
+
+
+class MessageWriteBehind:
+    def __init__(self, batch_size=WRITE_BEHIND_BATCH_SIZE, max_latency=WRITE_BEHIND_MAX_LATENCY,
+                 queue_size=WRITE_BEHIND_QUEUE_SIZE):
+        self.batch_size = batch_size
+        self.max_latency = max_latency
+        self._queue = queue.Queue(maxsize=queue_size)
+        self._stopping = threading.Event()
+        self._thread = None
+        self._lock = threading.Lock()
+        # [message, failed rounds]; only touched by the flusher (or shutdown after it)
+        self._dead_letters = []
+        self._dead_letter_due = 0.0
+
+    def submit(self, message):
+        """
+        Queue an unsaved message. Returns False when the queue is full or the
+        flusher is shutting down; the caller should then save synchronously.
+        """
+        if self._stopping.is_set():
+            return False
+        self._ensure_started()
+        try:
+            self._queue.put_nowait(message)
+        except queue.Full:
+            logger.warning("Write-behind queue full, falling back to a direct insert")
+            return False
+        return True
+
+    def shutdown(self, timeout=10):
+        """Stop the flusher and persist everything still queued."""
+        self._stopping.set()
+        thread = self._thread
+        if thread is not None:
+            thread.join(timeout)
+        leftover = self._drain(self._queue.qsize())
+        if leftover:
+            self._write(leftover)
+        if self._dead_letters:
+            self._retry_dead_letters(final=True)
+
+    def _ensure_started(self):
+        if self._thread is not None:
+            return
+        with self._lock:
+            if self._thread is None:
+                self._thread = threading.Thread(target=self._run, name='chat-write-behind', daemon=True)
+                self._thread.start()
+                atexit.register(self.shutdown)
+
+    def _drain(self, limit):
+        batch = []
+        while len(batch) < limit:
+            try:
+                batch.append(self._queue.get_nowait())
+            except queue.Empty:
+                break
+        return batch
+
+    def _run(self):
+        while not self._stopping.is_set():
+            if self._dead_letters and time.monotonic() >= self._dead_letter_due:
+                self._retry_dead_letters()
+            try:
+                first = self._queue.get(timeout=0.5)
+            except queue.Empty:
+                continue
+            batch = [first]
+            deadline = time.monotonic() + self.max_latency
+            while len(batch) < self.batch_size:
+                remaining = deadline - time.monotonic()
+                if remaining <= 0:
+                    break
+                try:
+                    batch.append(self._queue.get(timeout=remaining))
+                except queue.Empty:
+                    break
+            self._write(batch)
+
+    def _write(self, batch):
+        close_old_connections()
+        for attempt in range(1, WRITE_BEHIND_RETRIES + 1):
+            try:
+                with transaction.atomic():
+                    self._insert(batch)
+                return
+            except Exception:
+                logger.exception("Write-behind batch of %s messages failed (attempt %s)", len(batch), attempt)
+                close_old_connections()
+                time.sleep(0.1 * attempt)
+
+        # Isolate the bad rows so one invalid message doesn't hold back the batch
+        for message in batch:
+            if not self._insert_one(message):
+                logger.error("Dead-lettering message uid=%s room=%s", message.uid, message.room_id)
+                self._add_dead_letter(message)
+
+    def _insert_one(self, message):
+        try:
+            with transaction.atomic():
+                self._insert([message])
+        except Exception:
+            logger.exception("Insert of message uid=%s failed", message.uid)
+            # the insert was rolled back; don't let a returned pk survive into the retry
+            message.pk = None
+            message._state.adding = True
+            close_old_connections()
+            return False
+        return True
+
+    def _add_dead_letter(self, message):
+        if not self._dead_letters:
+            self._dead_letter_due = time.monotonic() + DEAD_LETTER_INTERVAL
+        self._dead_letters.append([message, 0])
+
+    def _retry_dead_letters(self, final=False):
+        close_old_connections()
+        pending = []
+        for entry in self._dead_letters:
+            message, rounds = entry
+            if self._insert_one(message):
+                logger.info("Persisted dead-lettered message uid=%s", message.uid)
+                continue
+            entry[1] = rounds = rounds + 1
+            if final or rounds >= DEAD_LETTER_RETRIES:
+                logger.error("Dropping unpersistable message uid=%s room=%s", message.uid, message.room_id)
+                self._notify_failed(message)
+            else:
+                pending.append(entry)
+        self._dead_letters = pending
+        self._dead_letter_due = time.monotonic() + DEAD_LETTER_INTERVAL
+
+    def _notify_failed(self, message):
+        # recipients already saw the broadcast: let them drop it, and let the sender resend
+        try:
+            if message.client_msg_id:
+                cache.delete(dedupe_key(message.room_id, message.sender_id, message.client_msg_id))
+            channel_layer = get_channel_layer()
+            room = ChatRoom.objects.filter(pk=message.room_id).first()
+            if channel_layer is None or room is None:
+                return
+            event = {
+                'type': 'message_failed', 'room_id': room.pk,
+                'message_uid': str(message.uid), 'client_msg_id': message.client_msg_id
+            }
+            for group in room_event_groups(room):
+                async_to_sync(channel_layer.group_send)(group, event)
+        except Exception:
+            logger.exception("Failed to notify room %s of dropped message uid=%s", message.room_id, message.uid)
+
+    def _insert(self, batch):
+        Message.objects.bulk_create(batch)
+        # Backends that don't return ids from bulk inserts: look them up by uid
+        missing = {m.uid: m for m in batch if m.id is None}
+        if missing:
+            for uid, pk in Message.objects.filter(uid__in=missing).values_list('uid', 'id'):
+                missing[uid].id = pk
+                missing[uid]._state.adding = False
+        record_new_messages(batch)
+
+
+writer = MessageWriteBehind()
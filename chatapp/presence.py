@@ -0,0 +1,114 @@
+"""
+Write-behind presence tracking.
+
+Presence lives in the cache as two keys per user:
+    user:{id}:online     -> 1, expires after PRESENCE_TTL seconds
+    user:{id}:last_seen  -> ISO timestamp, never expires
+
+Every HTTP request and WebSocket ping "touches" the user. Instead of writing
+both keys on every touch, touches are buffered per process: a user whose keys
+were written less than PRESENCE_FRESHNESS seconds ago is skipped, and pending
+users are flushed together with set_many at most every PRESENCE_FLUSH_WINDOW
+seconds.
+"""
+import logging
+import threading
+import time
+
+from django.conf import settings
+from django.core.cache import cache
+from django.utils import timezone
+
+logger = logging.getLogger(__name__)
+
+PRESENCE_TTL = getattr(settings, 'CHAT_PRESENCE_TTL', 120)
+PRESENCE_FLUSH_WINDOW = getattr(settings, 'CHAT_PRESENCE_FLUSH_WINDOW', 5)
+PRESENCE_FRESHNESS = getattr(settings, 'CHAT_PRESENCE_FRESHNESS', 30)
+
+
+def online_key(user_id):
+    return f"user:{user_id}:online"
+
+
+def last_seen_key(user_id):
+    return f"user:{user_id}:last_seen"
+
+
+class PresenceBuffer:
+    def __init__(self, ttl=PRESENCE_TTL, window=PRESENCE_FLUSH_WINDOW, freshness=PRESENCE_FRESHNESS):
+        # A fresh write must still be alive when the next one lands
+        self.ttl = ttl
+        self.window = window
+        self.freshness = min(freshness, max(ttl - window, 0))
+        self._pending = {}
+        self._last_written = {}
+        self._timer = None
+        self._lock = threading.Lock()
+
+    def touch(self, user_id, immediate=False):
+        """Record activity for `user_id`; cheap no-op while its last write is fresh."""
+        now = time.monotonic()
+        with self._lock:
+            written_at = self._last_written.get(user_id)
+            if not immediate and written_at is not None and now - written_at < self.freshness:
+                return
+            self._pending[user_id] = timezone.now().isoformat()
+            if not immediate and self._timer is None:
+                self._timer = threading.Timer(self.window, self.flush)
+                self._timer.daemon = True
+                self._timer.start()
+        if immediate:
+            self.flush()
+
+    def mark_seen(self, user_id):
+        """Update last_seen only (soft offline), bypassing the buffer."""
+        try:
+            cache.set(last_seen_key(user_id), timezone.now().isoformat(), timeout=None)
+        except Exception:
+            logger.exception("Failed to update last_seen for user %s", user_id)
+
+    def flush(self):
+        now = time.monotonic()
+        with self._lock:
+            pending, self._pending = self._pending, {}
+            if self._timer is not None:
+                self._timer.cancel()
+                self._timer = None
+            # forget users whose last write has gone stale anyway
+            self._last_written = {
+                uid: at for uid, at in self._last_written.items() if now - at < self.freshness
+            }
+            for uid in pending:
+                self._last_written[uid] = now
+        if not pending:
+            return
+        try:
+            cache.set_many({online_key(uid): 1 for uid in pending}, timeout=self.ttl)
+            cache.set_many({last_seen_key(uid): seen for uid, seen in pending.items()}, timeout=None)
+        except Exception:
+            logger.exception("Failed to flush presence for %s users", len(pending))
+            with self._lock:
+                for uid in pending:
+                    self._last_written.pop(uid, None)
+
+
+presence = PresenceBuffer()
+
+
+def get_many(user_ids):
+    """
+    Resolve presence for many users with a single cache round-trip.
+    Returns {user_id: {'is_online': bool, 'last_seen': str | None}}.
+    """
+    user_ids = [uid for uid in set(user_ids) if uid is not None]
+    if not user_ids:
+        return {}
+    keys = [online_key(uid) for uid in user_ids] + [last_seen_key(uid) for uid in user_ids]
+    values = cache.get_many(keys)
+    return {
+        uid: {
+            'is_online': bool(values.get(online_key(uid))),
+            'last_seen': values.get(last_seen_key(uid)),
+        }
+        for uid in user_ids
+    }
@@ -0,0 +1,106 @@
+"""
+Inbound frame rate limiting for WebSocket consumers.
+
+RateLimitMixin gives every connection an in-memory token bucket
+(CHAT_WS_RATE frames/second, bursts up to CHAT_WS_BURST): a couple of float
+operations per frame, no I/O. Optionally, write frames can also be charged to
+a per-user budget shared by all of the user's connections and workers
+(CHAT_WS_USER_RATE per CHAT_WS_USER_WINDOW seconds), kept in the Django cache
+as a fixed-window counter. Rejected frames get an error frame back.
+
+Control frames (typing, ping) are charged to a separate, larger bucket
+(CHAT_WS_CONTROL_RATE / CHAT_WS_CONTROL_BURST), so a user typing on every
+keystroke never eats into the allowance for sending messages.
+"""
+import time
+
+from django.conf import settings
+from django.core.cache import cache
+
+from . import metrics
+
+WS_RATE = getattr(settings, 'CHAT_WS_RATE', 5.0)
+WS_BURST = getattr(settings, 'CHAT_WS_BURST', 20)
+WS_CONTROL_RATE = getattr(settings, 'CHAT_WS_CONTROL_RATE', 20.0)
+WS_CONTROL_BURST = getattr(settings, 'CHAT_WS_CONTROL_BURST', 40)
+CONTROL_FRAME_TYPES = frozenset(('typing', 'ping'))
+# None disables the shared per-user budget
+WS_USER_RATE = getattr(settings, 'CHAT_WS_USER_RATE', None)
+WS_USER_WINDOW = getattr(settings, 'CHAT_WS_USER_WINDOW', 10)
+
+
+class TokenBucket:
+    __slots__ = ('rate', 'capacity', 'tokens', 'updated')
+
+    def __init__(self, rate, capacity):
+        self.rate = rate
+        self.capacity = capacity
+        self.tokens = capacity
+        self.updated = time.monotonic()
+
+    def consume(self, tokens=1):
+        now = time.monotonic()
+        self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.rate)
+        self.updated = now
+        if self.tokens >= tokens:
+            self.tokens -= tokens
+            return True
+        return False
+
+
+def user_budget_allows(user_id, limit=None, window=WS_USER_WINDOW):
+    """Shared per-user fixed-window budget: one cache add/incr per charged frame."""
+    limit = WS_USER_RATE if limit is None else limit
+    if not limit or user_id is None:
+        return True
+    key = f"ratelimit:ws:user:{user_id}:{int(time.time() // window)}"
+    if cache.add(key, 1, timeout=window * 2):
+        return True
+    try:
+        return cache.incr(key) <= limit
+    except ValueError:
+        cache.set(key, 1, timeout=window * 2)
+        return True
+
+
+class RateLimitMixin:
+    """
+    Mix into an AsyncWebsocketConsumer. Once the frame type is known:
+        if not await self.allow_frame(frame_type): return
+    and before frames that write (e.g. chat messages):
+        if not await self.allow_frame_for_user(): return
+    Override `rate_limit_error_frame()` to match the consumer's frame format.
+    """
+    ws_rate = WS_RATE
+    ws_burst = WS_BURST
+    ws_control_rate = WS_CONTROL_RATE
+    ws_control_burst = WS_CONTROL_BURST
+    control_frame_types = CONTROL_FRAME_TYPES
+
+    async def allow_frame(self, frame_type=None):
+        if frame_type in self.control_frame_types:
+            bucket = getattr(self, '_control_bucket', None)
+            if bucket is None:
+                bucket = self._control_bucket = TokenBucket(self.ws_control_rate, self.ws_control_burst)
+        else:
+            bucket = getattr(self, '_rate_bucket', None)
+            if bucket is None:
+                bucket = self._rate_bucket = TokenBucket(self.ws_rate, self.ws_burst)
+        if bucket.consume():
+            return True
+        metrics.incr('ratelimit.rejected.connection')
+        await self.send_rate_limited()
+        return False
+
+    async def allow_frame_for_user(self):
+        if WS_USER_RATE is None or user_budget_allows(getattr(getattr(self, 'user', None), 'id', None)):
+            return True
+        metrics.incr('ratelimit.rejected.user')
+        await self.send_rate_limited()
+        return False
+
+    async def send_rate_limited(self):
+        await self.send(text_data=self.rate_limit_error_frame())
+
+    def rate_limit_error_frame(self):
+        return '{"type": "error", "message": "rate_limited"}'
@@ -0,0 +1,81 @@
+"""
+High-water-mark read receipts.
+
+Each participant of a room has one RoomReadCursor row holding the id of the
+newest message they have read. A message is read by its recipient when its id
+is at or below the recipient's cursor, so marking read is a single-row upsert
+and unread counts are a range comparison (id > cursor) instead of per-message
+is_read updates.
+"""
+from django.db import models
+from django.db.models import Case, F, Value, When
+from django.utils import timezone
+
+from .models import Message, RoomReadCursor
+
+
+def advance_read_cursors(user_id, targets, existing=()):
+    """
+    Move `user_id`'s cursors forward (never backwards) to `targets`, a
+    {room_id: message_id} map. Rooms listed in `existing` already have a
+    cursor; the others get one from a single INSERT ... ON CONFLICT DO NOTHING
+    (a racing insert is then caught up by the UPDATE). All existing cursors
+    move with one UPDATE, so any number of rooms costs at most two queries.
+    """
+    targets = {room_id: message_id for room_id, message_id in targets.items() if message_id}
+    if not targets:
+        return
+    now = timezone.now()
+    missing = targets.keys() - set(existing)
+    if missing:
+        RoomReadCursor.objects.bulk_create(
+            [RoomReadCursor(room_id=room_id, user_id=user_id, last_read_message_id=targets[room_id])
+             for room_id in missing],
+            ignore_conflicts=True,
+        )
+    target = Case(
+        *(When(room_id=room_id, then=Value(message_id)) for room_id, message_id in targets.items()),
+        default=F('last_read_message_id'),
+        output_field=models.BigIntegerField(),
+    )
+    RoomReadCursor.objects.filter(user_id=user_id, room_id__in=list(targets)).filter(
+        last_read_message_id__lt=target
+    ).update(last_read_message_id=target, updated_at=now)
+
+
+def get_read_cursor(room_id, user_id):
+    return RoomReadCursor.objects.filter(
+        room_id=room_id, user_id=user_id
+    ).values_list('last_read_message_id', flat=True).first() or 0
+
+
+def apply_read_state(messages):
+    """
+    Set the backward-compatible `is_read` on Message instances from their
+    recipients' cursors: one query for any number of messages. A room has
+    two participants, so the recipient's cursor is the one not owned by the sender.
+    """
+    pending = [m for m in messages if not getattr(m, '_read_state_applied', False)]
+    room_ids = {m.room_id for m in pending if m.room_id is not None}
+    if not room_ids:
+        return messages
+
+    cursors = {}
+    for room_id, user_id, last_read in RoomReadCursor.objects.filter(room_id__in=room_ids).values_list(
+        'room_id', 'user_id', 'last_read_message_id'
+    ):
+        cursors.setdefault(room_id, []).append((user_id, last_read))
+
+    for message in pending:
+        # legacy rows may still carry is_read=True from before cursors existed
+        message.is_read = message.is_read or any(
+            user_id != message.sender_id and message.id is not None and message.id <= last_read
+            for user_id, last_read in cursors.get(message.room_id, ())
+        )
+        message._read_state_applied = True
+    return messages
+
+
+def unread_messages(room_id, user_id, after_id):
+    """Messages in the room the user hasn't read: the range above their cursor."""
+    return Message.objects.filter(room_id=room_id, id__gt=after_id).exclude(sender_id=user_id)
@@ -0,0 +1,25 @@
+import json
+
+from rest_framework.renderers import BaseRenderer
+from rest_framework.utils.encoders import JSONEncoder
+
+
+class NDJSONRenderer(BaseRenderer):
+    """
+    Newline-delimited JSON. Registers `?format=ndjson` / `Accept: application/x-ndjson`
+    with DRF content negotiation; streaming views build their own response and
+    only use render() for non-streamed payloads such as errors.
+    """
+    media_type = 'application/x-ndjson'
+    format = 'ndjson'
+    charset = 'utf-8'
+
+    def render(self, data, accepted_media_type=None, renderer_context=None):
+        if data is None:
+            return b''
+        rows = data if isinstance(data, list) else [data]
+        return ''.join(self.encode_row(row) for row in rows).encode(self.charset)
+
+    @staticmethod
+    def encode_row(row):
+        return json.dumps(row, cls=JSONEncoder, ensure_ascii=False) + '\n'
@@ -4,4 +4,6 @@ from . import consumers
 websocket_urlpatterns = [
     # re_path(r'ws/chat/<int:id>/', consumers.ChatConsumer.as_asgi()),
     re_path(r'ws/chat/(?P<user_id>\w+)/(?P<room_id>\w+)/$', consumers.ChatConsumer.as_asgi()),
+    # one socket for all of the user's rooms; needs JwtAuthMiddleware in the ASGI stack
+    re_path(r'ws/chat/$', consumers.ChatMultiplexConsumer.as_asgi()),
 ]
\ No newline at end of file
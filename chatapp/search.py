@@ -0,0 +1,128 @@
+"""
+Full-text search over message content, scoped to the caller's rooms.
+
+- Postgres: `to_tsvector('simple', content) @@ plainto_tsquery(...)`, served by
+  the GIN expression index chat_msg_content_fts_idx (migration 0009).
+- Other databases (SQLite): the MessageSearchTerm inverted index, filled by
+  index_messages() from utils.record_new_messages; existing rows are indexed
+  with `manage.py rebuild_search_index`.
+
+Both backends match whole lowercased words and require every query term
+(AND). Results are newest first, keyset-paginated on message id, and carry an
+HTML-escaped snippet with the matches wrapped in <mark>.
+"""
+import html
+import re
+
+from django.db import connection
+from django.db.models import BooleanField, Count, Q
+from django.db.models.expressions import RawSQL
+
+from .models import ChatRoom, Message, MessageSearchTerm
+
+# Must match the expression of the GIN index created in migration 0009
+SEARCH_CONFIG = 'simple'
+SEARCH_LIMIT = 20
+MAX_SEARCH_LIMIT = 100
+MAX_QUERY_TERMS = 8
+MAX_TERMS_PER_MESSAGE = 200
+MIN_TERM_LENGTH = 2
+MAX_TERM_LENGTH = 64
+SNIPPET_RADIUS = 60
+
+_WORD = re.compile(r'\w+')
+
+
+def tokenize(text):
+    """Distinct lowercased words of `text`, in order of first appearance."""
+    terms = []
+    seen = set()
+    for word in _WORD.findall(text.lower()):
+        if MIN_TERM_LENGTH <= len(word) <= MAX_TERM_LENGTH and word not in seen:
+            seen.add(word)
+            terms.append(word)
+    return terms
+
+
+def uses_postgres():
+    return connection.vendor == 'postgresql'
+
+
+def index_messages(messages):
+    """Add inverted-index postings for freshly saved messages (no-op on Postgres)."""
+    if uses_postgres():
+        return
+    postings = [
+        MessageSearchTerm(term=term, room_id=message.room_id, message_id=message.id)
+        for message in messages
+        if message.id is not None and message.room_id is not None
+        for term in tokenize(message.content)[:MAX_TERMS_PER_MESSAGE]
+    ]
+    MessageSearchTerm.objects.bulk_create(postings, batch_size=1000)
+
+
+def match(queryset, query, room_ids=None):
+    """Narrow a Message queryset to messages containing every term of `query`."""
+    terms = tokenize(query)[:MAX_QUERY_TERMS]
+    if not terms:
+        return queryset.none()
+    if uses_postgres():
+        table = connection.ops.quote_name(Message._meta.db_table)
+        return queryset.filter(RawSQL(
+            f"to_tsvector('{SEARCH_CONFIG}', {table}.content) @@ plainto_tsquery('{SEARCH_CONFIG}', %s)",
+            [' '.join(terms)],
+            output_field=BooleanField()
+        ))
+    postings = MessageSearchTerm.objects.filter(term__in=terms)
+    if room_ids is not None:
+        # keeps the lookup on the (term, room, message) index
+        postings = postings.filter(room_id__in=room_ids)
+    matched = postings.values('message_id').annotate(
+        matched=Count('term', distinct=True)
+    ).filter(matched=len(terms)).values('message_id')
+    return queryset.filter(id__in=matched)
+
+
+def search_messages(user, query, room_id=None, before_id=None, limit=SEARCH_LIMIT):
+    """
+    Messages of `user`'s rooms (or one of them) matching `query`, newest first.
+    Returns (messages, has_more); every message gets a `snippet` attribute.
+    """
+    room_ids = ChatRoom.objects.filter(Q(customer=user) | Q(professional=user))
+    if room_id is not None:
+        room_ids = room_ids.filter(pk=room_id)
+    room_ids = room_ids.values('id')
+
+    queryset = match(Message.objects.filter(room_id__in=room_ids), query, room_ids)
+    if before_id is not None:
+        queryset = queryset.filter(id__lt=before_id)
+    messages = list(queryset.select_related('sender').order_by('-id')[:limit + 1])
+    has_more = len(messages) > limit
+    messages = messages[:limit]
+
+    terms = tokenize(query)[:MAX_QUERY_TERMS]
+    for message in messages:
+        message.snippet = highlight(message.content, terms)
+    return messages, has_more
+
+
+def highlight(content, terms, radius=SNIPPET_RADIUS):
+    """HTML-escaped excerpt around the first match, matches wrapped in <mark>."""
+    if not terms:
+        return html.escape(content[:radius * 2])
+    pattern = re.compile(
+        r'(?<!\w)(' + '|'.join(re.escape(term) for term in terms) + r')(?!\w)', re.IGNORECASE
+    )
+    first = pattern.search(content)
+    start = max(0, first.start() - radius) if first else 0
+    end = min(len(content), (first.end() if first else 0) + radius)
+    excerpt = content[start:end]
+
+    pieces = []
+    position = 0
+    for found in pattern.finditer(excerpt):
+        pieces.append(html.escape(excerpt[position:found.start()]))
+        pieces.append(f"<mark>{html.escape(found.group())}</mark>")
+        position = found.end()
+    pieces.append(html.escape(excerpt[position:]))
+    return ('…' if start > 0 else '') + ''.join(pieces) + ('…' if end < len(content) else '')
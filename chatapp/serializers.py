@@ -1,10 +1,12 @@
 from rest_framework import serializers
+from django.db import models
 from .models import ChatRoom, Message
 from django.contrib.auth import get_user_model
 
+from . import presence, receipts
+from .dedupe import normalize_client_msg_id
+
 User = get_user_model()
-from django.utils import timezone
-from django.core.cache import cache
 
 
 class UserBasicSerializer(serializers.ModelSerializer):
@@ -35,43 +37,106 @@ class UserBasicSerializer(serializers.ModelSerializer):
             return request.build_absolute_uri(obj.professional.profile_pic.url)
         return None
     
+    def _presence(self, obj):
+        # Normally prefetched for the whole payload by PresencePrefetchMixin
+        resolved = self.context.setdefault('presence', {})
+        if obj.id not in resolved:
+            resolved.update(presence.get_many([obj.id]))
+        return resolved[obj.id]
+
     def get_is_online(self, obj):
-        return bool(cache.get(f"user:{obj.id}:online"))
+        return self._presence(obj)['is_online']
 
     def get_last_seen(self, obj):
-        return cache.get(f"user:{obj.id}:last_seen")
+        return self._presence(obj)['last_seen']
+
+
+class PresencePrefetchMixin:
+    """
+    For serializers embedding UserBasicSerializer: resolve presence for every
+    user referenced by `presence_sources` (FK names) with one cache.get_many,
+    stored in the shared serializer context.
+
+    `prefetch` is the hook PrefetchListSerializer calls once for all rows;
+    subclasses extend it to load other per-payload state.
+    """
+    presence_sources = ()
+
+    def prefetch(self, instances):
+        self.prefetch_presence(instances)
+
+    def prefetch_presence(self, instances):
+        resolved = self.context.setdefault('presence', {})
+        user_ids = {
+            getattr(instance, f'{source}_id', None)
+            for instance in instances
+            for source in self.presence_sources
+        }
+        missing = user_ids - resolved.keys() - {None}
+        if missing:
+            resolved.update(presence.get_many(missing))
+
+    def to_representation(self, instance):
+        self.prefetch([instance])
+        return super().to_representation(instance)
+
 
+class PrefetchListSerializer(serializers.ListSerializer):
+    """Prefetch presence (and other per-payload state) for all rows up front instead of per row."""
 
-class MessageSerializer(serializers.ModelSerializer):
+    def to_representation(self, data):
+        items = list(data.all() if isinstance(data, models.manager.BaseManager) else data)
+        self.child.prefetch(items)
+        return super().to_representation(items)
+
+
+class MessageSerializer(PresencePrefetchMixin, serializers.ModelSerializer):
     sender_info = UserBasicSerializer(source='sender', read_only=True)
+    presence_sources = ('sender',)
 
     class Meta:
         model = Message
-        fields = ['id', 'room', 'sender', 'sender_info', 'content', 'is_read', 'created_at']
-        read_only_fields = ['sender', 'created_at', 'is_read']
+        list_serializer_class = PrefetchListSerializer
+        fields = ['id', 'uid', 'client_msg_id', 'room', 'sender', 'sender_info', 'content', 'is_read', 'created_at']
+        read_only_fields = ['uid', 'client_msg_id', 'sender', 'created_at', 'is_read']
+
+    def prefetch(self, instances):
+        super().prefetch(instances)
+        # is_read is derived from the recipients' read cursors
+        receipts.apply_read_state(instances)
 
 
 class MessageCreateSerializer(serializers.ModelSerializer):
     class Meta:
         model = Message
-        fields = ['room', 'content']
+        fields = ['room', 'content', 'client_msg_id']
+        # retries with a known client_msg_id return the original (dedupe.create_once), not a 400
+        validators = []
 
     def validate_room(self, value):
         user = self.context['request'].user
-        # Check if user is part of this room
-        if value.customer != user and value.professional != user:
+        # Check if user is part of this room (by id: no participant rows loaded)
+        if user.id not in (value.customer_id, value.professional_id):
             raise serializers.ValidationError("You are not a member of this chat room")
         return value
 
+    def validate_client_msg_id(self, value):
+        try:
+            return normalize_client_msg_id(value)
+        except ValueError as exc:
+            raise serializers.ValidationError(str(exc))
+
 
-class ChatRoomSerializer(serializers.ModelSerializer):
+class ChatRoomSerializer(PresencePrefetchMixin, serializers.ModelSerializer):
     customer_info = UserBasicSerializer(source='customer', read_only=True)
     professional_info = UserBasicSerializer(source='professional', read_only=True)
     last_message = serializers.SerializerMethodField()
     unread_count = serializers.SerializerMethodField()
+    presence_sources = ('customer', 'professional')
 
     class Meta:
         model = ChatRoom
+        list_serializer_class = PrefetchListSerializer
         fields = [
             'id', 'customer', 'professional', 
             'customer_info', 'professional_info',
@@ -81,22 +146,28 @@ class ChatRoomSerializer(serializers.ModelSerializer):
         read_only_fields = ['created_at', 'updated_at']
 
     def get_last_message(self, obj):
-        last_msg = obj.messages.last()
-        if last_msg:
-            return {
-                'id': last_msg.id,
-                'content': last_msg.content,
-                'created_at': last_msg.created_at,
-                'sender_id': last_msg.sender.id,
-                'sender_email': last_msg.sender.email,
-                'is_read': last_msg.is_read
-            }
-        return None
+        # Served from the denormalized snapshot kept by utils.record_new_message
+        if obj.last_message_id is None:
+            return None
+        sender = obj.last_message_sender
+        # The last message is read once its recipient has no unread messages left
+        if sender is not None and sender.id == obj.customer_id:
+            is_read = obj.professional_unread_count == 0
+        else:
+            is_read = obj.customer_unread_count == 0
+        return {
+            'id': obj.last_message_id,
+            'content': obj.last_message_preview,
+            'created_at': obj.last_message_at,
+            'sender_id': sender.id if sender else None,
+            'sender_email': sender.email if sender else None,
+            'is_read': is_read
+        }
 
     def get_unread_count(self, obj):
         request = self.context.get('request')
-        if request and request.user:
-            return obj.messages.filter(is_read=False).exclude(sender=request.user).count()
+        # WebSocket callers have no request and pass the user directly
+        user = request.user if request else self.context.get('user')
+        if user:
+            return obj.unread_count_for(user)
         return 0
-
-
@@ -0,0 +1,35 @@
+from asgiref.sync import async_to_sync
+from channels.layers import get_channel_layer
+from django.db import transaction
+from django.db.models.signals import post_delete, post_save
+from django.dispatch import receiver
+
+from .broadcast import room_event_groups
+from .models import ChatRoom
+
+
+def notify_room_invalidated(room):
+    """Tell open chat sockets of the room (per-room and multiplexed) to reload it."""
+    channel_layer = get_channel_layer()
+    if channel_layer is None:
+        return
+    for group in room_event_groups(room):
+        async_to_sync(channel_layer.group_send)(
+            group,
+            {"type": "room_invalidated", "room_id": room.pk}
+        )
+
+
+@receiver(post_save, sender=ChatRoom)
+def room_saved(sender, instance, created, **kwargs):
+    # message bookkeeping uses queryset.update(), so this only fires on real room edits
+    if created:
+        return
+    transaction.on_commit(lambda: notify_room_invalidated(instance))
+
+
+@receiver(post_delete, sender=ChatRoom)
+def room_deleted(sender, instance, **kwargs):
+    # pk is cleared after delete; keep a detached copy for the notification
+    room = ChatRoom(pk=instance.pk, customer_id=instance.customer_id, professional_id=instance.professional_id)
+    transaction.on_commit(lambda: notify_room_invalidated(room))
@@ -0,0 +1,132 @@
+"""
+Delta sync for reconnecting clients.
+
+Instead of re-fetching the room list and every room's history after a
+network blip, a client sends back the watermark it got from its last sync and
+receives only what changed since then, in one bounded response:
+
+- rooms whose `updated_at` moved past the watermark (new messages, unread
+  counter changes, room edits), keyset-ordered on (updated_at, id)
+- messages of the user's rooms with an id above the watermark, in id order
+
+Watermarks are opaque strings "<updated_at µs>.<room id>.<message id>". When
+either list is cut at its bound `has_more` is set and the client syncs again
+with the new watermark. Without a watermark the rooms come back in full and
+the message cursor starts at the newest message; the latest page of each room
+is then read from the history endpoints (which are cached).
+
+Timestamps and ids are assigned before commit, so a transaction committing
+late can land below a watermark already handed out. The watermark that ends a
+sync therefore trails the newest position seen by an overlap window
+(SYNC_OVERLAP_SECONDS of room updates, SYNC_OVERLAP_MESSAGES message ids) and
+the next sync re-reads that window; clients dedupe rooms by id and messages
+by id/uid. Watermarks continuing a cut-off page (`has_more`) stay exact.
+"""
+from datetime import datetime, timedelta, timezone as dt_timezone
+
+from django.conf import settings
+from django.db.models import Max, Q
+from django.utils import timezone
+
+from . import history_cache, receipts
+from .models import ChatRoom, Message
+
+SYNC_MAX_ROOMS = getattr(settings, 'CHAT_SYNC_MAX_ROOMS', 100)
+SYNC_MAX_MESSAGES = getattr(settings, 'CHAT_SYNC_MAX_MESSAGES', 500)
+# Re-read window below the newest position seen, for late commits
+SYNC_OVERLAP_SECONDS = getattr(settings, 'CHAT_SYNC_OVERLAP_SECONDS', 5)
+SYNC_OVERLAP_MESSAGES = getattr(settings, 'CHAT_SYNC_OVERLAP_MESSAGES', 50)
+
+_EPOCH = datetime(1970, 1, 1, tzinfo=dt_timezone.utc)
+_MICROSECOND = timedelta(microseconds=1)
+# ids are bigint columns
+_MAX_PART = 2 ** 63 - 1
+
+
+def encode_watermark(updated_at, room_id, message_id):
+    micros = 0
+    if updated_at is not None:
+        if timezone.is_naive(updated_at):
+            updated_at = updated_at.replace(tzinfo=dt_timezone.utc)
+        micros = (updated_at - _EPOCH) // _MICROSECOND
+    return f"{micros}.{room_id or 0}.{message_id or 0}"
+
+
+def decode_watermark(watermark):
+    """(updated_at, room_id, message_id) from a watermark; raises ValueError."""
+    micros, room_id, message_id = (int(part) for part in str(watermark).split('.'))
+    if not all(0 <= part <= _MAX_PART for part in (micros, room_id, message_id)):
+        raise ValueError("invalid watermark")
+    try:
+        updated_at = _EPOCH + micros * _MICROSECOND
+    except OverflowError:
+        # past datetime.max: client input, not a server error
+        raise ValueError("invalid watermark") from None
+    if not settings.USE_TZ:
+        updated_at = updated_at.replace(tzinfo=None)
+    return updated_at, room_id, message_id
+
+
+def sync_changes(user, watermark=None, max_rooms=None, max_messages=None):
+    """
+    Rooms and messages of `user` changed since `watermark`.
+
+    Returns (rooms, message rows, new watermark, has_more). Rooms are model
+    instances ready for ChatRoomSerializer; message rows use the
+    history_cache.message_row format plus `room_id`. Three queries at most,
+    whatever the number of rooms.
+    """
+    # callers may ask for less, never for more than the configured bounds
+    max_rooms = max(1, min(max_rooms or SYNC_MAX_ROOMS, SYNC_MAX_ROOMS))
+    max_messages = max(1, min(max_messages or SYNC_MAX_MESSAGES, SYNC_MAX_MESSAGES))
+    user_rooms = ChatRoom.objects.filter(Q(customer=user) | Q(professional=user))
+
+    rooms_qs = user_rooms.select_related(
+        'customer__profile', 'professional__profile', 'last_message_sender'
+    )
+    if watermark:
+        since, since_room_id, since_message_id = decode_watermark(watermark)
+        rooms_qs = rooms_qs.filter(
+            Q(updated_at__gt=since) | Q(updated_at=since, id__gt=since_room_id)
+        )
+    else:
+        since, since_room_id, since_message_id = None, 0, None
+    rooms = list(rooms_qs.order_by('updated_at', 'id')[:max_rooms + 1])
+    rooms_truncated = len(rooms) > max_rooms
+    rooms = rooms[:max_rooms]
+    rooms_seen = bool(rooms)
+    if rooms:
+        since, since_room_id = rooms[-1].updated_at, rooms[-1].id
+
+    rows = []
+    messages_truncated = False
+    room_ids = user_rooms.values('id')
+    if since_message_id is None:
+        since_message_id = Message.objects.filter(room_id__in=room_ids).aggregate(
+            upto=Max('id')
+        )['upto'] or 0
+        messages_seen = True
+    else:
+        messages = list(
+            Message.objects.filter(room_id__in=room_ids, id__gt=since_message_id)
+            .select_related('sender')
+            .order_by('id')[:max_messages + 1]
+        )
+        messages_truncated = len(messages) > max_messages
+        messages = messages[:max_messages]
+        receipts.apply_read_state(messages)
+        rows = [{'room_id': msg.room_id, **history_cache.message_row(msg)} for msg in messages]
+        messages_seen = bool(messages)
+        if messages:
+            since_message_id = messages[-1].id
+
+    has_more = rooms_truncated or messages_truncated
+    if not has_more:
+        # trail the newest position seen so the next sync re-reads the overlap
+        # window; a sync that saw nothing new hands its watermark back unchanged
+        if rooms_seen and since is not None:
+            since, since_room_id = since - timedelta(seconds=SYNC_OVERLAP_SECONDS), 0
+        if messages_seen:
+            since_message_id = max(since_message_id - SYNC_OVERLAP_MESSAGES, 0)
+    new_watermark = encode_watermark(since, since_room_id, since_message_id)
+    return rooms, rows, new_watermark, has_more
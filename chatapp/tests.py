@@ -1,3 +1,178 @@
-from django.test import TestCase
+from datetime import timedelta
+from unittest import mock
 
-# Create your tests here.
+from django.contrib.auth import get_user_model
+from django.test import SimpleTestCase, TestCase
+from django.utils import timezone
+
+from . import archive, ratelimit, wire
+from .models import ChatRoom, Message
+from .pagination import message_page
+from .ratelimit import TokenBucket
+from .sync import decode_watermark, encode_watermark
+
+User = get_user_model()
+
+
+def make_room(prefix):
+    customer = User.objects.create_user(f'{prefix}-customer@example.com', 'x', role='user')
+    professional = User.objects.create_user(f'{prefix}-professional@example.com', 'x', role='professional')
+    return ChatRoom.objects.create(customer=customer, professional=professional)
+
+
+def make_messages(room, times):
+    senders = [room.customer, room.professional]
+    return [
+        Message.objects.create(room=room, sender=senders[n % 2], content=f'message {n}', created_at=created_at)
+        for n, created_at in enumerate(times)
+    ]
+
+
+def ids(messages):
+    return [message.id for message in messages]
+
+
+class MessagePageTests(TestCase):
+    def setUp(self):
+        self.room = make_room('page')
+        now = timezone.now()
+        # the last two share a timestamp: ties are broken by id
+        self.messages = make_messages(self.room, [now - timedelta(minutes=n) for n in (4, 3, 2, 1, 1)])
+        self.queryset = self.room.messages.all()
+
+    def test_latest_page(self):
+        page, has_more = message_page(self.queryset, limit=2)
+        self.assertEqual(ids(page), ids(self.messages[3:]))
+        self.assertTrue(has_more)
+
+    def test_before_id(self):
+        page, has_more = message_page(self.queryset, before_id=self.messages[4].id, limit=3)
+        self.assertEqual(ids(page), ids(self.messages[1:4]))
+        self.assertTrue(has_more)
+        page, has_more = message_page(self.queryset, before_id=self.messages[2].id, limit=3)
+        self.assertEqual(ids(page), ids(self.messages[:2]))
+        self.assertFalse(has_more)
+
+    def test_after_id(self):
+        page, has_more = message_page(self.queryset, after_id=self.messages[0].id, limit=3)
+        self.assertEqual(ids(page), ids(self.messages[1:4]))
+        self.assertTrue(has_more)
+        page, has_more = message_page(self.queryset, after_id=self.messages[3].id, limit=3)
+        self.assertEqual(ids(page), ids(self.messages[4:]))
+        self.assertFalse(has_more)
+
+    def test_cursor_outside_queryset(self):
+        other = make_messages(make_room('other'), [timezone.now()])
+        self.assertEqual(message_page(self.queryset, before_id=other[0].id), ([], False))
+        self.assertEqual(message_page(self.queryset, after_id=other[0].id), ([], False))
+
+
+class ArchivePagingTests(TestCase):
+    def setUp(self):
+        self.room = make_room('archive')
+        now = timezone.now()
+        month = archive.add_months(archive.month_start(timezone.localtime(now)), -24)
+        start, _ = archive.month_bounds(month)
+        self.archived = ids(make_messages(self.room, [start + timedelta(days=1, hours=n) for n in range(3)]))
+        self.hot = ids(make_messages(self.room, [now - timedelta(minutes=3 - n) for n in range(3)]))
+        self.assertEqual(archive.archive_month(month), 3)
+        self.room.refresh_from_db()
+
+    def page(self, **kwargs):
+        messages, has_more = archive.room_page(self.room, self.room.messages.all(), **kwargs)
+        return ids(messages), has_more
+
+    def test_latest_page_continues_into_archive(self):
+        self.assertEqual(self.page(limit=5), (self.archived[1:] + self.hot, True))
+        self.assertEqual(self.page(limit=10), (self.archived + self.hot, False))
+
+    def test_latest_page_filled_by_hot_rows(self):
+        self.assertEqual(self.page(limit=3), (self.hot, True))
+
+    def test_before_id_in_hot_continues_into_archive(self):
+        self.assertEqual(self.page(before_id=self.hot[1], limit=3), (self.archived[1:] + self.hot[:1], True))
+        self.assertEqual(self.page(before_id=self.hot[0], limit=3), (self.archived, False))
+
+    def test_before_id_in_archive(self):
+        self.assertEqual(self.page(before_id=self.archived[2], limit=1), (self.archived[1:2], True))
+        self.assertEqual(self.page(before_id=self.archived[1], limit=5), (self.archived[:1], False))
+
+    def test_after_id_in_archive_continues_into_hot(self):
+        self.assertEqual(self.page(after_id=self.archived[0], limit=4), (self.archived[1:] + self.hot[:2], True))
+        self.assertEqual(self.page(after_id=self.archived[0], limit=10), (self.archived[1:] + self.hot, False))
+
+    def test_after_id_in_archive_exact_fill(self):
+        # the archive fills the page exactly; the hot rows after it still count
+        self.assertEqual(self.page(after_id=self.archived[0], limit=2), (self.archived[1:], True))
+
+    def test_after_id_in_hot(self):
+        self.assertEqual(self.page(after_id=self.hot[0], limit=5), (self.hot[1:], False))
+
+    def test_unknown_cursor(self):
+        self.assertEqual(self.page(before_id=self.hot[-1] + 1000), ([], False))
+
+
+class DecodeWatermarkTests(SimpleTestCase):
+    def test_round_trip(self):
+        updated_at = timezone.now().replace(microsecond=123456)
+        self.assertEqual(decode_watermark(encode_watermark(updated_at, 7, 42)), (updated_at, 7, 42))
+
+    def test_invalid(self):
+        for watermark in ('', 'abc', '1.2', '1.2.3.4', '-1.0.0', '0.-1.0', f'0.0.{2 ** 63}', f'{2 ** 62}.0.0'):
+            with self.subTest(watermark=watermark), self.assertRaises(ValueError):
+                decode_watermark(watermark)
+
+
+class WireRenameTests(SimpleTestCase):
+    frame = {
+        'type': 'history', 'room_id': 3, 'has_more': True, 'unknown_field': {'type': 'custom'},
+        'messages': [{'type': 'chat_message', 'message_id': 1, 'content': 'hi', 'extra': [1, 'two']}],
+    }
+
+    def test_round_trip(self):
+        coded = wire._rename(self.frame, wire.FIELD_CODES, wire.TYPE_CODES)
+        self.assertEqual(coded['t'], 'hi')
+        self.assertEqual(coded['ms'][0], {'t': 'cm', 'mi': 1, 'co': 'hi', 'extra': [1, 'two']})
+        self.assertEqual(coded['unknown_field'], {'t': 'custom'})
+        self.assertEqual(wire._rename(coded, wire.FIELD_NAMES, wire.TYPE_NAMES), self.frame)
+
+    def test_codes_are_unique(self):
+        self.assertEqual(len(wire.FIELD_NAMES), len(wire.FIELD_CODES))
+        self.assertEqual(len(wire.TYPE_NAMES), len(wire.TYPE_CODES))
+
+    def test_pack_round_trip(self):
+        if wire.msgpack is None:
+            self.skipTest('msgpack is not installed')
+        self.assertEqual(wire.unpack(wire.pack(self.frame)), self.frame)
+        with self.assertRaises(ValueError):
+            wire.unpack(b'\xc1')
+
+
+class TokenBucketTests(SimpleTestCase):
+    def setUp(self):
+        self.now = 100.0
+        patcher = mock.patch.object(ratelimit.time, 'monotonic', side_effect=lambda: self.now)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+
+    def test_burst_up_to_capacity(self):
+        bucket = TokenBucket(rate=1, capacity=3)
+        self.assertEqual([bucket.consume() for _ in range(4)], [True, True, True, False])
+
+    def test_refills_at_rate(self):
+        bucket = TokenBucket(rate=2, capacity=2)
+        self.assertTrue(bucket.consume(2))
+        self.assertFalse(bucket.consume())
+        self.now += 0.5
+        self.assertTrue(bucket.consume())
+        self.assertFalse(bucket.consume())
+
+    def test_refill_capped_at_capacity(self):
+        bucket = TokenBucket(rate=10, capacity=2)
+        self.now += 60
+        self.assertEqual([bucket.consume() for _ in range(3)], [True, True, False])
+
+    def test_failed_consume_keeps_tokens(self):
+        bucket = TokenBucket(rate=1, capacity=3)
+        self.assertFalse(bucket.consume(4))
+        self.assertTrue(bucket.consume(3))
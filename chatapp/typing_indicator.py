@@ -0,0 +1,128 @@
+"""
+Ephemeral typing indicators for chat consumers.
+
+Typing frames never touch the ORM or the cache: state lives on the connection
+and events only travel through the channel layer. Per connection and room:
+
+- at most TYPING_MAX_FRAMES_PER_SECOND inbound typing frames are considered,
+  the rest are dropped silently;
+- a "started" event is broadcast at most once per TYPING_WINDOW seconds while
+  the user keeps typing;
+- a "stopped" event is broadcast on an explicit stop, after TYPING_TIMEOUT
+  seconds without typing frames, or on disconnect.
+"""
+import asyncio
+import logging
+import time
+
+from django.conf import settings
+
+logger = logging.getLogger(__name__)
+
+TYPING_WINDOW = getattr(settings, 'CHAT_TYPING_WINDOW', 3.0)
+TYPING_TIMEOUT = getattr(settings, 'CHAT_TYPING_TIMEOUT', 5.0)
+TYPING_MAX_FRAMES_PER_SECOND = getattr(settings, 'CHAT_TYPING_MAX_FRAMES_PER_SECOND', 10)
+
+
+class _TypingState:
+    __slots__ = ('typing', 'last_broadcast', 'frame_window', 'frames', 'stop_handle', 'extra')
+
+    def __init__(self):
+        self.typing = False
+        # event extras (room_id...) of the last typing frame, reused for the stop on disconnect
+        self.extra = {}
+        self.last_broadcast = 0.0
+        self.frame_window = 0.0
+        self.frames = 0
+        self.stop_handle = None
+
+
+class TypingIndicatorMixin:
+    """
+    Mix into an AsyncWebsocketConsumer together with OutboundQueueMixin and
+    WireProtocolMixin. Call `handle_typing(group, is_typing)` from receive(),
+    `stop_all_typing()` from disconnect(); the `typing_event` handler queues
+    other participants' events on the socket.
+    """
+
+    def _typing_states(self):
+        states = getattr(self, '_typing', None)
+        if states is None:
+            states = self._typing = {}
+        return states
+
+    async def handle_typing(self, group, is_typing, **extra):
+        state = self._typing_states().setdefault(group, _TypingState())
+        now = time.monotonic()
+
+        # fixed one-second window rate limit
+        if now - state.frame_window >= 1.0:
+            state.frame_window = now
+            state.frames = 0
+        state.frames += 1
+        if state.frames > TYPING_MAX_FRAMES_PER_SECOND:
+            return
+
+        if not is_typing:
+            await self._typing_stopped(group, **extra)
+            return
+
+        state.extra = extra
+        self._schedule_typing_stop(state, group, extra)
+        if state.typing and now - state.last_broadcast < TYPING_WINDOW:
+            return  # coalesced
+        state.typing = True
+        state.last_broadcast = now
+        await self._broadcast_typing(group, True, extra)
+
+    async def stop_all_typing(self):
+        for group, state in list(self._typing_states().items()):
+            await self._typing_stopped(group, **state.extra)
+
+    async def typing_event(self, event):
+        if event.get('sender_channel') == self.channel_name:
+            return
+        frame = {key: value for key, value in event.items() if key not in ('type', 'sender_channel')}
+        # a newer typing state for the same user/room supersedes a queued one
+        coalesce_key = ('typing', event.get('room_id'), event['user_id'])
+        await self.enqueue_frame(**self.frame_data({'type': 'typing', **frame}), coalesce_key=coalesce_key)
+
+    def typing_groups(self, group):
+        """Groups a typing event for `group` fans out to; override to add more."""
+        return [group]
+
+    def _schedule_typing_stop(self, state, group, extra):
+        if state.stop_handle is not None:
+            state.stop_handle.cancel()
+        loop = asyncio.get_running_loop()
+        state.stop_handle = loop.call_later(
+            TYPING_TIMEOUT, lambda: asyncio.ensure_future(self._typing_stopped(group, **extra))
+        )
+
+    async def _typing_stopped(self, group, **extra):
+        state = self._typing_states().get(group)
+        if state is None:
+            return
+        if state.stop_handle is not None:
+            state.stop_handle.cancel()
+            state.stop_handle = None
+        if not state.typing:
+            return
+        state.typing = False
+        state.last_broadcast = 0.0
+        await self._broadcast_typing(group, False, extra)
+
+    async def _broadcast_typing(self, group, is_typing, extra):
+        event = {
+            'type': 'typing_event',
+            'sender_channel': self.channel_name,
+            'user_id': self.user.id,
+            'user_role': getattr(self.user, 'role', None),
+            'is_typing': is_typing,
+            **extra,
+        }
+        try:
+            for target in self.typing_groups(group):
+                await self.channel_layer.group_send(target, event)
+        except Exception:
+            logger.exception("Failed to broadcast typing state to %s", group)
@@ -5,7 +5,9 @@ from .views import (
     ChatRoomMessagesAPIView,
     ChatRoomMarkReadAPIView,
     UnreadSummaryAPIView,
+    ChatSyncAPIView,
     MessageListCreateAPIView,
+    MessageSearchAPIView,
     MessageMarkReadAPIView,
     MessageMarkMultipleReadAPIView,
     MessageUnreadCountAPIView
@@ -18,9 +20,11 @@ urlpatterns = [
     path('rooms/<int:room_id>/messages/', ChatRoomMessagesAPIView.as_view(), name='chatroom-messages'),
     path('rooms/<int:room_id>/mark_read/', ChatRoomMarkReadAPIView.as_view(), name='chatroom-mark-read'),
     path('rooms/unread_summary/', UnreadSummaryAPIView.as_view(), name='chatroom-unread-summary'),
+    path('sync/', ChatSyncAPIView.as_view(), name='chat-sync'),
 
     # Message endpoints
     path('messages/', MessageListCreateAPIView.as_view(), name='message-list-create'),
+    path('messages/search/', MessageSearchAPIView.as_view(), name='message-search'),
     path('messages/<int:message_id>/mark_read/', MessageMarkReadAPIView.as_view(), name='message-mark-read'),
     path('messages/mark_multiple_read/', MessageMarkMultipleReadAPIView.as_view(), name='message-mark-multiple-read'),
     path('messages/unread_count/', MessageUnreadCountAPIView.as_view(), name='message-unread-count'),
@@ -36,11 +40,13 @@ urlpatterns = [
 # - GET    /api/rooms/{id}/messages/        - Get room messages
 # - POST   /api/rooms/{id}/mark_read/       - Mark room messages as read
 # - GET    /api/rooms/unread_summary/       - Get unread summary
+# - GET    /api/sync/?since={watermark}     - Rooms and messages changed since the watermark
 # - POST   /api/rooms/start/           - Start with user
 #
 # Messages:
 # - GET    /api/messages/                   - List all messages
 # - POST   /api/messages/                   - Send new message
+# - GET    /api/messages/search/?q={text}   - Search messages of your rooms
 # - GET    /api/messages/{id}/              - Get specific message
 # - PATCH  /api/messages/{id}/mark_read/    - Mark message as read
 # - GET    /api/messages/unread_count/      - Get total unread count
@@ -0,0 +1,195 @@
+from functools import partial
+
+from django.conf import settings
+from django.core.cache import cache
+from django.db import transaction
+from django.db.models import Case, Count, F, OuterRef, Q, Subquery, Sum, Value, When
+from django.db.models.functions import Coalesce
+from django.utils import timezone
+
+from . import history_cache, receipts, search
+from .models import ChatRoom, Message, RoomReadCursor
+
+LAST_MESSAGE_PREVIEW_LENGTH = 255
+# Seconds to cache a user's unread summary; 0 disables the cache
+UNREAD_SUMMARY_CACHE_TTL = getattr(settings, 'CHAT_UNREAD_SUMMARY_CACHE_TTL', 300)
+UNREAD_FIELDS = ('customer_unread_count', 'professional_unread_count')
+
+
+def record_new_message(message):
+    """
+    Keep the room's denormalized state in step with a freshly saved message:
+    bump the recipient's unread counter and replace the last-message snapshot.
+    Runs as a single UPDATE, which also touches `updated_at`.
+    """
+    record_new_messages([message])
+
+
+def record_new_messages(messages):
+    """Batch form of record_new_message: one UPDATE per room touched."""
+    by_room = {}
+    for message in messages:
+        if message.room is not None:
+            by_room.setdefault(message.room_id, []).append(message)
+
+    now = timezone.now()
+    for room_messages in by_room.values():
+        room = room_messages[0].room
+        to_professional = sum(
+            1 for m in room_messages if m.sender_id is not None and m.sender_id == room.customer_id
+        )
+        to_customer = len(room_messages) - to_professional
+        last = max(room_messages, key=lambda m: (m.created_at, m.id or 0))
+
+        ChatRoom.objects.filter(pk=room.pk).update(
+            customer_unread_count=F('customer_unread_count') + to_customer,
+            professional_unread_count=F('professional_unread_count') + to_professional,
+            last_message_id=last.id,
+            last_message_preview=last.content[:LAST_MESSAGE_PREVIEW_LENGTH],
+            last_message_sender_id=last.sender_id,
+            last_message_at=last.created_at,
+            updated_at=now,
+        )
+        # after commit, so a concurrent cache refill can't miss these rows
+        transaction.on_commit(partial(history_cache.push, room.pk, room_messages))
+        transaction.on_commit(partial(invalidate_unread_summary, [room.customer_id, room.professional_id]))
+    search.index_messages(messages)
+
+
+def mark_room_read(room, user):
+    """Mark everything up to the room's latest message as read for `user`."""
+    return mark_read_upto(room.pk, user, room.last_message_id)
+
+
+def mark_read_upto(room_id, user, message_id):
+    """
+    Advance `user`'s read cursor in the room to `message_id` and return how many
+    messages that newly marked read. Messages themselves are never rewritten.
+    """
+    return mark_read_upto_many(user, {room_id: message_id})
+
+
+def mark_read_upto_many(user, targets):
+    """
+    Batch form of mark_read_upto for a {room_id: message_id} map, returning the
+    total newly marked read. The number newly read is the drop in the user's
+    unread counter across the recount, so the cost is a fixed handful of
+    queries (counters, cursor upsert, recount, counters again) for any number
+    of rooms. Rooms the user isn't part of, or has nothing unread in, are skipped.
+    """
+    targets = {room_id: message_id for room_id, message_id in targets.items() if message_id}
+    if not targets:
+        return 0
+    rooms = {
+        room.pk: room for room in ChatRoom.objects.filter(id__in=list(targets)).filter(
+            Q(customer=user) | Q(professional=user)
+        ).annotate(read_cursor=Subquery(
+            RoomReadCursor.objects.filter(room=OuterRef('pk'), user=user).values('last_read_message_id')[:1]
+        )).only('customer_id', 'professional_id', 'customer_unread_count', 'professional_unread_count')
+    }
+    pending = {
+        room_id: targets[room_id] for room_id, room in rooms.items()
+        if room.unread_count_for(user) and (room.read_cursor or 0) < targets[room_id]
+    }
+    if not pending:
+        return 0
+
+    receipts.advance_read_cursors(
+        user.id, pending, existing={room_id for room_id in pending if rooms[room_id].read_cursor is not None}
+    )
+    refresh_unread_counts(pending, user, sides={rooms[room_id].unread_field_for(user) for room_id in pending})
+    before = sum(rooms[room_id].unread_count_for(user) for room_id in pending)
+    after = total_unread_count(user, room_ids=pending)
+    return max(before - after, 0)
+
+
+def total_unread_count(user, room_ids=None):
+    """Sum of `user`'s unread counters across all their rooms (or just `room_ids`), in one query."""
+    rooms = ChatRoom.objects.filter(Q(customer=user) | Q(professional=user))
+    if room_ids is not None:
+        rooms = rooms.filter(id__in=list(room_ids))
+    return rooms.aggregate(
+        total=Sum(Case(
+            When(customer=user, then=F('customer_unread_count')),
+            default=F('professional_unread_count'),
+        ))
+    )['total'] or 0
+
+
+def refresh_unread_counts(room_ids, user, sides=UNREAD_FIELDS):
+    """
+    Recount `user`'s unread counter for the given rooms from their read cursors.
+    One UPDATE per participant side, regardless of how many rooms are involved;
+    callers that know which sides `user` is on can pass just those counter
+    fields as `sides`.
+    """
+    room_ids = list(set(room_ids))
+    if not room_ids:
+        return
+    cursor = Coalesce(Subquery(
+        RoomReadCursor.objects.filter(room=OuterRef(OuterRef('pk')), user=user)
+        .values('last_read_message_id')[:1]
+    ), Value(0))
+    unread = Coalesce(Subquery(
+        Message.objects.filter(room=OuterRef('pk'), id__gt=cursor)
+        .exclude(sender=user)
+        .order_by()
+        .values('room')
+        .annotate(total=Count('id'))
+        .values('total')[:1]
+    ), Value(0))
+
+    rooms = ChatRoom.objects.filter(id__in=room_ids)
+    # touch updated_at so delta sync (sync.py) picks up the new counters
+    now = timezone.now()
+    if 'customer_unread_count' in sides:
+        rooms.filter(customer=user).update(customer_unread_count=unread, updated_at=now)
+    if 'professional_unread_count' in sides:
+        rooms.filter(professional=user).update(professional_unread_count=unread, updated_at=now)
+    transaction.on_commit(partial(history_cache.invalidate, room_ids))
+    transaction.on_commit(partial(invalidate_unread_summary, [user.id]))
+
+
+def unread_summary_key(user_id):
+    return f"chat:user:{user_id}:unread_summary"
+
+
+def invalidate_unread_summary(user_ids):
+    if UNREAD_SUMMARY_CACHE_TTL:
+        cache.delete_many([unread_summary_key(uid) for uid in set(user_ids) if uid is not None])
+
+
+def get_unread_summary(user):
+    """
+    Unread count and counterpart email for every room of `user` with unread
+    messages, read from the per-participant counters in a single joined query.
+    Cached per user until a message is created or marked read.
+    """
+    if UNREAD_SUMMARY_CACHE_TTL:
+        summary = cache.get(unread_summary_key(user.id))
+        if summary is not None:
+            return summary
+
+    is_customer = Q(customer=user)
+    rows = ChatRoom.objects.filter(is_customer | Q(professional=user)).annotate(
+        unread=Case(
+            When(is_customer, then=F('customer_unread_count')),
+            default=F('professional_unread_count'),
+        ),
+        other_user=Case(
+            When(is_customer, then=F('professional__email')),
+            default=F('customer__email'),
+        ),
+    ).filter(unread__gt=0).order_by('-updated_at').values('id', 'unread', 'other_user')
+
+    rooms = [
+        {'room_id': row['id'], 'unread_count': row['unread'], 'other_user': row['other_user']}
+        for row in rows
+    ]
+    summary = {
+        'total_unread': sum(item['unread_count'] for item in rooms),
+        'rooms': rooms
+    }
+    if UNREAD_SUMMARY_CACHE_TTL:
+        cache.set(unread_summary_key(user.id), summary, timeout=UNREAD_SUMMARY_CACHE_TTL)
+    return summary
@@ -1,7 +1,11 @@
 from rest_framework.views import APIView
 from rest_framework.response import Response
 from rest_framework import status, permissions
-from django.db.models import Q, Max, Prefetch
+from rest_framework.settings import api_settings
+from asgiref.sync import sync_to_async
+from django.core.handlers.asgi import ASGIRequest
+from django.db.models import F, Max, Q
+from django.http import StreamingHttpResponse
 from django.shortcuts import get_object_or_404
 from django.contrib.auth import get_user_model
 
@@ -11,6 +15,21 @@ from .serializers import (
     MessageSerializer,
     MessageCreateSerializer
 )
+from .utils import (
+    record_new_message,
+    mark_room_read,
+    mark_read_upto,
+    mark_read_upto_many,
+    total_unread_count,
+    get_unread_summary
+)
+from .pagination import clamp_limit, message_page
+from . import archive, history_cache, receipts
+from .renderers import NDJSONRenderer
+from .sync import sync_changes
+from .search import MAX_SEARCH_LIMIT, SEARCH_LIMIT, search_messages
+from .dedupe import create_once
+from .conditional import not_modified, room_list_version, room_messages_version, with_validators
 
 User =get_user_model()
 class ChatRoomListCreateAPIView(APIView):
@@ -19,22 +38,27 @@ class ChatRoomListCreateAPIView(APIView):
     def get(self, request):
         """List all chat rooms for the current user"""
         user = request.user
+        # Polls with an unchanged room list stop here, before any serializer runs
+        etag, last_modified = room_list_version(request)
+        unchanged = not_modified(request, etag, last_modified)
+        if unchanged is not None:
+            return unchanged
+
+        # Unread counters and the last-message snapshot live on the room row,
+        # so the whole list is a single query however many rooms the user has.
         rooms = ChatRoom.objects.filter(
             Q(customer=user) | Q(professional=user)
-        ).select_related('customer', 'professional'
-        ).prefetch_related(
-            Prefetch('messages', queryset=Message.objects.order_by('-created_at'))
-        ).annotate(
-            last_message_time=Max('messages__created_at')
-        ).order_by('-last_message_time')
+        ).select_related(
+            'customer__profile', 'professional__profile', 'last_message_sender'
+        ).order_by(F('last_message_at').desc(nulls_last=True), '-updated_at')
 
         serializer = ChatRoomSerializer(rooms, many=True, context={'request': request})
-        return Response({
+        return with_validators(Response({
                 "status": "success",
                 "status_code": status.HTTP_200_OK,
                 "message": "fetch your data successfully",
                 "data": serializer.data
-            })
+            }), etag, last_modified)
 
     def post(self, request):
         current_user = request.user
@@ -67,6 +91,8 @@ class ChatRoomListCreateAPIView(APIView):
 
         existing_room = ChatRoom.objects.filter(
             professional=professional, customer=customer
+        ).select_related(
+            'customer__profile', 'professional__profile', 'last_message_sender'
         ).first()
 
         if existing_room:
@@ -97,7 +123,10 @@ class ChatRoomDetailAPIView(APIView):
 
     def get(self, request, room_id):
         """Retrieve a specific chat room"""
-        room = get_object_or_404(ChatRoom, id=room_id)
+        room = get_object_or_404(
+            ChatRoom.objects.select_related('customer__profile', 'professional__profile', 'last_message_sender'),
+            id=room_id
+        )
         if request.user not in [room.customer, room.professional]:
             return Response({'error': 'You are not a member of this chat'}, status=403)
 
@@ -111,16 +140,56 @@ class ChatRoomMessagesAPIView(APIView):
     def get(self, request, room_id):
         """Get messages of a chat room"""
         room = get_object_or_404(ChatRoom, id=room_id)
-        if request.user not in [room.customer, room.professional]:
+        # compare ids: loading both users would cost two queries per poll
+        if request.user.id not in [room.customer_id, room.professional_id]:
             return Response({'error': 'Access denied'}, status=403)
 
-        limit = int(request.query_params.get('limit', 50))
-        offset = int(request.query_params.get('offset', 0))
-        messages = room.messages.select_related('sender').order_by('-created_at')[offset:offset+limit]
-        messages = list(reversed(messages))
-
+        etag, last_modified = room_messages_version(request, room)
+        unchanged = not_modified(request, etag, last_modified)
+        if unchanged is not None:
+            return unchanged
+
+        params = request.query_params
+        try:
+            limit = clamp_limit(params.get('limit'))
+            before_id = int(params['before_id']) if params.get('before_id') else None
+            after_id = int(params['after_id']) if params.get('after_id') else None
+            offset = int(params['offset']) if params.get('offset') else None
+        except ValueError:
+            return Response({'error': 'limit, offset, before_id and after_id must be integers'}, status=400)
+
+        queryset = room.messages.select_related('sender__profile')
+
+        # Legacy offset mode, kept for older clients
+        if offset is not None:
+            messages = list(reversed(queryset.order_by('-created_at', '-id')[offset:offset+limit]))
+            serializer = MessageSerializer(messages, many=True, context={'request': request})
+            return with_validators(
+                Response({'count': room.messages.count(), 'results': serializer.data}), etag, last_modified
+            )
+
+        if before_id is None and after_id is None:
+            # Latest page: served from the per-room ring buffer when warm
+            rows, has_more = history_cache.recent_messages(room.id, limit)
+            rows, has_more = archive.extend_latest(room, rows, has_more, limit)
+            messages = history_cache.rows_to_messages(room.id, rows, read_state_current=True)
+        else:
+            # continues into the cold archive once the hot table runs out
+            messages, has_more = archive.room_page(room, queryset, before_id=before_id, after_id=after_id, limit=limit)
         serializer = MessageSerializer(messages, many=True, context={'request': request})
-        return Response({'count': room.messages.count(), 'results': serializer.data})
+
+        data = {
+            'results': serializer.data,
+            'has_more': has_more,
+            'next_before_id': messages[0].id if messages else before_id,
+            'next_after_id': messages[-1].id if messages else after_id,
+        }
+        # COUNT(*) grows with the room, so cursor requests only pay for it on demand
+        cursor_mode = before_id is not None or after_id is not None
+        include_count = params.get('include_count', 'false' if cursor_mode else 'true')
+        if include_count.lower() in ('1', 'true', 'yes'):
+            data['count'] = room.messages.count() + archive.archived_count(room)
+        return with_validators(Response(data), etag, last_modified)
 
 
 class ChatRoomMarkReadAPIView(APIView):
@@ -129,7 +198,9 @@ class ChatRoomMarkReadAPIView(APIView):
     def post(self, request, room_id):
         """Mark all unread messages in this room as read"""
         room = get_object_or_404(ChatRoom, id=room_id)
-        updated_count = Message.objects.filter(room=room, is_read=False).exclude(sender=request.user).update(is_read=True)
+        if request.user.id not in [room.customer_id, room.professional_id]:
+            return Response({'error': 'Access denied'}, status=403)
+        updated_count = mark_room_read(room, request.user)
         return Response({'status': 'success', 'marked_read': updated_count})
 
 
@@ -138,46 +209,167 @@ class UnreadSummaryAPIView(APIView):
 
     def get(self, request):
         """Get unread message count for each room"""
-        user = request.user
-        rooms = ChatRoom.objects.filter(Q(customer=user) | Q(professional=user))
-        summary = []
-
-        for room in rooms:
-            unread = room.messages.filter(is_read=False).exclude(sender=user).count()
-            if unread > 0:
-                summary.append({
-                    'room_id': room.id,
-                    'unread_count': unread,
-                    'other_user': room.professional.email if room.customer == user else room.customer.email
-                })
+        return Response(get_unread_summary(request.user))
+
+
+class ChatSyncAPIView(APIView):
+    permission_classes = [permissions.IsAuthenticated]
+
+    def get(self, request):
+        """Rooms and messages changed since the client's watermark (?since=)"""
+        params = request.query_params
+        try:
+            max_rooms = int(params['max_rooms']) if params.get('max_rooms') else None
+            max_messages = int(params['max_messages']) if params.get('max_messages') else None
+            rooms, messages, watermark, has_more = sync_changes(
+                request.user, params.get('since'), max_rooms, max_messages
+            )
+        except ValueError:
+            return Response({'error': 'since must be a watermark from a previous sync; max_rooms and max_messages must be integers'}, status=400)
 
+        serializer = ChatRoomSerializer(rooms, many=True, context={'request': request})
         return Response({
-            'total_unread': sum(item['unread_count'] for item in summary),
-            'rooms': summary
+            'rooms': serializer.data,
+            'messages': messages,
+            'watermark': watermark,
+            'has_more': has_more
         })
 
 
 class MessageListCreateAPIView(APIView):
     permission_classes = [permissions.IsAuthenticated]
+    renderer_classes = [*api_settings.DEFAULT_RENDERER_CLASSES, NDJSONRenderer]
+    export_chunk_size = 500
 
     def get(self, request):
-        """List all messages for the user"""
+        """
+        List all messages for the user, newest first.
+
+        - ?format=ndjson: streamed export of the whole history, one JSON object per line
+        - ?limit / ?before_id / ?after_id: cursor pages (constant memory)
+        - no parameters: the full list in one response, kept for older clients
+        """
         user = request.user
         messages = Message.objects.filter(
             Q(room__customer=user) | Q(room__professional=user)
-        ).select_related('sender', 'room').order_by('-created_at')
+        ).select_related('sender__profile')
+
+        if request.accepted_renderer.format == NDJSONRenderer.format:
+            # Under ASGI Django would drain a sync iterator into a list before
+            # sending anything, so stream from an async one there
+            rows = self.aexport_rows if isinstance(request._request, ASGIRequest) else self.export_rows
+            response = StreamingHttpResponse(
+                rows(request, messages),
+                content_type=NDJSONRenderer.media_type
+            )
+            response['Content-Disposition'] = 'attachment; filename="messages.ndjson"'
+            return response
+
+        params = request.query_params
+        if not any(params.get(key) for key in ('limit', 'before_id', 'after_id')):
+            serializer = MessageSerializer(messages.order_by('-created_at'), many=True, context={'request': request})
+            return Response(serializer.data)
+
+        try:
+            limit = clamp_limit(params.get('limit'))
+            before_id = int(params['before_id']) if params.get('before_id') else None
+            after_id = int(params['after_id']) if params.get('after_id') else None
+        except ValueError:
+            return Response({'error': 'limit, before_id and after_id must be integers'}, status=400)
+
+        page, has_more = message_page(messages, before_id=before_id, after_id=after_id, limit=limit)
+        page.reverse()  # newest first, like the full list
+        serializer = MessageSerializer(page, many=True, context={'request': request})
+        return Response({
+            'results': serializer.data,
+            'has_more': has_more,
+            'next_before_id': page[-1].id if page else before_id,
+            'next_after_id': page[0].id if page else after_id,
+        })
 
-        serializer = MessageSerializer(messages, many=True, context={'request': request})
-        return Response(serializer.data)
+    def export_chunk(self, request, messages, cursor=None):
+        """
+        One NDJSON chunk of the export, newest first, keyset-paginated on
+        (created_at, id) below `cursor`. Returns (text, next cursor or None).
+        """
+        if cursor is not None:
+            created_at, message_id = cursor
+            messages = messages.filter(Q(created_at__lt=created_at) | Q(created_at=created_at, id__lt=message_id))
+        chunk = list(messages.order_by('-created_at', '-id')[:self.export_chunk_size])
+        if not chunk:
+            return '', None
+        # Serialize chunk by chunk so presence is still resolved in bulk
+        rows = MessageSerializer(chunk, many=True, context={'request': request}).data
+        text = ''.join(NDJSONRenderer.encode_row(row) for row in rows)
+        if len(chunk) < self.export_chunk_size:
+            return text, None
+        return text, (chunk[-1].created_at, chunk[-1].id)
+
+    def export_rows(self, request, messages):
+        """Streamed export for WSGI."""
+        text, cursor = self.export_chunk(request, messages)
+        yield text
+        while cursor is not None:
+            text, cursor = self.export_chunk(request, messages, cursor)
+            yield text
+
+    async def aexport_rows(self, request, messages):
+        """Streamed export for ASGI: each chunk is queried and serialized off the event loop."""
+        export_chunk = sync_to_async(self.export_chunk)
+        text, cursor = await export_chunk(request, messages)
+        yield text
+        while cursor is not None:
+            text, cursor = await export_chunk(request, messages, cursor)
+            yield text
 
     def post(self, request):
         """Send a new message"""
         serializer = MessageCreateSerializer(data=request.data, context={'request': request})
         serializer.is_valid(raise_exception=True)
-        message = serializer.save(sender=request.user)
-        message.room.save(update_fields=['updated_at'])
+
+        def create():
+            message = serializer.save(sender=request.user)
+            record_new_message(message)
+            # no cursor can be past a message that was just created: it is unread
+            message._read_state_applied = True
+            return message
+
+        # a retried send with the same client_msg_id returns the original message
+        message, created = create_once(
+            serializer.validated_data['room'], request.user,
+            serializer.validated_data.get('client_msg_id'), create
+        )
         output = MessageSerializer(message, context={'request': request})
-        return Response(output.data, status=status.HTTP_201_CREATED)
+        return Response(output.data, status=status.HTTP_201_CREATED if created else status.HTTP_200_OK)
+
+
+class MessageSearchAPIView(APIView):
+    permission_classes = [permissions.IsAuthenticated]
+
+    def get(self, request):
+        """Search messages of the user's rooms (?q=, optional ?room_id=, ?before_id=, ?limit=)"""
+        params = request.query_params
+        query = (params.get('q') or '').strip()
+        if not query:
+            return Response({'error': 'q is required'}, status=400)
+        try:
+            limit = clamp_limit(params.get('limit'), default=SEARCH_LIMIT)
+            limit = min(limit, MAX_SEARCH_LIMIT)
+            room_id = int(params['room_id']) if params.get('room_id') else None
+            before_id = int(params['before_id']) if params.get('before_id') else None
+        except ValueError:
+            return Response({'error': 'limit, room_id and before_id must be integers'}, status=400)
+
+        messages, has_more = search_messages(request.user, query, room_id, before_id, limit)
+        receipts.apply_read_state(messages)
+        return Response({
+            'results': [
+                {'room_id': msg.room_id, **history_cache.message_row(msg), 'snippet': msg.snippet}
+                for msg in messages
+            ],
+            'has_more': has_more,
+            'next_before_id': messages[-1].id if messages else before_id,
+        })
 
 
 class MessageMarkReadAPIView(APIView):
@@ -185,11 +377,16 @@ class MessageMarkReadAPIView(APIView):
 
     def patch(self, request, message_id):
         """Mark a specific message as read"""
-        message = get_object_or_404(Message, id=message_id)
-        if message.sender == request.user:
+        message = get_object_or_404(Message.objects.select_related('room', 'sender__profile'), id=message_id)
+        if message.sender_id == request.user.id:
             return Response({'error': 'Cannot mark your own message as read'}, status=400)
-        message.is_read = True
-        message.save(update_fields=['is_read'])
+        room = message.room
+        if room is None or request.user.id not in [room.customer_id, room.professional_id]:
+            return Response({'error': 'Access denied'}, status=403)
+        # Moves the read cursor; everything up to this message becomes read
+        mark_read_upto(room.id, request.user, message.id)
+        # the recipient's cursor is now at or past this message
+        message.is_read, message._read_state_applied = True, True
         serializer = MessageSerializer(message, context={'request': request})
         return Response(serializer.data)
 
@@ -203,10 +400,12 @@ class MessageMarkMultipleReadAPIView(APIView):
         if not message_ids:
             return Response({'error': 'message_ids is required'}, status=400)
 
-        updated = Message.objects.filter(
+        # One cursor move per room, up to the newest of the given messages
+        targets = Message.objects.filter(
             id__in=message_ids,
             room__in=ChatRoom.objects.filter(Q(customer=request.user) | Q(professional=request.user))
-        ).exclude(sender=request.user).update(is_read=True)
+        ).exclude(sender=request.user).order_by().values('room_id').annotate(upto=Max('id'))
+        updated = mark_read_upto_many(request.user, {target['room_id']: target['upto'] for target in targets})
 
         return Response({'status': 'success', 'marked_read': updated})
 
@@ -216,8 +415,5 @@ class MessageUnreadCountAPIView(APIView):
 
     def get(self, request):
         """Get total unread count"""
-        count = Message.objects.filter(
-            Q(room__customer=request.user) | Q(room__professional=request.user),
-            is_read=False
-        ).exclude(sender=request.user).count()
+        count = total_unread_count(request.user)
         return Response({'unread_count': count})
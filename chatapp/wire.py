@@ -0,0 +1,165 @@
+"""
+WebSocket wire formats: JSON text frames (default) and an optional compact
+MessagePack framing negotiated through Sec-WebSocket-Protocol.
+
+A client that offers the `chat.msgpack.v1` subprotocol (and a server with
+msgpack installed) gets binary frames in both directions, with the known
+field names and frame types replaced by short codes (FIELD_CODES,
+TYPE_CODES); unknown fields pass through unchanged. Every other client keeps
+speaking JSON text on the same consumers.
+
+Broadcast events carry the MessagePack frame pre-encoded next to the JSON
+one (broadcast.payload_event), so fan-out stays encode-once for both.
+"""
+import json
+from datetime import date, datetime
+
+from django.conf import settings
+
+try:
+    import msgpack
+except ImportError:  # optional dependency
+    msgpack = None
+
+SUBPROTOCOL_MSGPACK = 'chat.msgpack.v1'
+MSGPACK_ENABLED = msgpack is not None and getattr(settings, 'CHAT_WS_MSGPACK', True)
+
+FIELD_CODES = {
+    'type': 't',
+    'room_id': 'r',
+    'message': 'm',
+    'user_role': 'ur',
+    'message_id': 'mi',
+    'message_uid': 'mu',
+    'client_msg_id': 'ci',
+    'is_read': 'ir',
+    'created_at': 'ca',
+    'sender_id': 'si',
+    'sender_email': 'se',
+    'sender_role': 'sr',
+    'content': 'co',
+    'messages': 'ms',
+    'has_more': 'hm',
+    'count': 'n',
+    'limit': 'l',
+    'before_id': 'bi',
+    'after_id': 'ai',
+    'include_count': 'ic',
+    'message_ids': 'mis',
+    'message_uids': 'mus',
+    'updated': 'up',
+    'is_typing': 'it',
+    'user_id': 'ui',
+    'duplicate': 'dp',
+    'rooms': 'rs',
+    'watermark': 'wm',
+    'since': 'sn',
+    'max_rooms': 'xr',
+    'max_messages': 'xm',
+    'status_code': 'sc',
+    'data': 'd',
+    'timestamp': 'ts',
+    'read': 'rd',
+}
+TYPE_CODES = {
+    'chat_message': 'cm',
+    'typing': 'ty',
+    'history': 'hi',
+    'mark_read': 'mr',
+    'mark_read_ack': 'ma',
+    'read_receipt': 'rr',
+    'error': 'er',
+    'ping': 'pi',
+    'send': 'sd',
+    'sync': 'sy',
+}
+FIELD_NAMES = {code: name for name, code in FIELD_CODES.items()}
+TYPE_NAMES = {code: name for name, code in TYPE_CODES.items()}
+
+
+def _rename(value, keys, types):
+    if isinstance(value, dict):
+        renamed = {}
+        for key, item in value.items():
+            if key in ('type', 't') and isinstance(item, str):
+                item = types.get(item, item)
+            else:
+                item = _rename(item, keys, types)
+            renamed[keys.get(key, key)] = item
+        return renamed
+    if isinstance(value, list):
+        return [_rename(item, keys, types) for item in value]
+    return value
+
+
+def _default(value):
+    if isinstance(value, (datetime, date)):
+        return value.isoformat()
+    return str(value)
+
+
+def pack(frame):
+    """MessagePack bytes of a frame dict, with short field codes."""
+    return msgpack.packb(_rename(frame, FIELD_CODES, TYPE_CODES), default=_default, use_bin_type=True)
+
+
+def unpack(data):
+    """Frame dict from MessagePack bytes with short field codes; raises ValueError."""
+    try:
+        frame = msgpack.unpackb(data, raw=False)
+    except Exception as exc:
+        raise ValueError("invalid msgpack frame") from exc
+    return _rename(frame, FIELD_NAMES, TYPE_NAMES)
+
+
+class WireProtocolMixin:
+    """
+    Mix into an AsyncWebsocketConsumer (before RateLimitMixin and
+    OutboundQueueMixin). Accept with `await self.accept_wire()`, read frames
+    with `self.decode_frame(text_data, bytes_data)` and send dicts with
+    `send_frame()` / `frame_data()`; the negotiated format is applied.
+    """
+    wire_binary = False
+
+    async def accept_wire(self):
+        offered = self.scope.get('subprotocols') or []
+        if MSGPACK_ENABLED and SUBPROTOCOL_MSGPACK in offered:
+            self.wire_binary = True
+            await self.accept(subprotocol=SUBPROTOCOL_MSGPACK)
+        else:
+            await self.accept()
+
+    def decode_frame(self, text_data=None, bytes_data=None):
+        """Inbound frame as a dict; raises ValueError for anything else."""
+        if bytes_data is not None:
+            if not self.wire_binary:
+                raise ValueError("binary frame on a JSON connection")
+            frame = unpack(bytes_data)
+        else:
+            frame = json.loads(text_data)
+        if not isinstance(frame, dict):
+            raise ValueError("frame must be an object")
+        return frame
+
+    def frame_data(self, frame, json_encoder=None):
+        """send()/enqueue_frame() keyword arguments for a frame dict."""
+        if self.wire_binary:
+            return {'bytes_data': pack(frame)}
+        return {'text_data': json.dumps(frame, cls=json_encoder)}
+
+    def event_frame_data(self, event):
+        """Forward a pre-encoded broadcast event (broadcast.payload_event) in this connection's format."""
+        from .broadcast import event_frame
+        if self.wire_binary:
+            packed = event.get('packed')
+            return {'bytes_data': packed if packed is not None else pack(json.loads(event_frame(event)))}
+        return {'text_data': event_frame(event)}
+
+    async def send_frame(self, frame, json_encoder=None):
+        await self.send(**self.frame_data(frame, json_encoder))
+
+    async def send_rate_limited(self):
+        if self.wire_binary:
+            await self.send(bytes_data=pack(json.loads(self.rate_limit_error_frame())))
+        else:
+            await super().send_rate_limited()
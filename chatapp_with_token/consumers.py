@@ -1,4 +1,3 @@
-import json
 from channels.generic.websocket import AsyncWebsocketConsumer
 from channels.db import database_sync_to_async
 from django.contrib.auth import get_user_model
@@ -6,14 +5,52 @@ from django.db.models import Q
 import jwt
 
 from project import settings
+from apps.chatapp import encoding, wire
+from apps.chatapp.broadcast import is_foreign
+from apps.chatapp.ratelimit import RateLimitMixin
+from apps.chatapp.wire import WireProtocolMixin
 from .models import ChatRoom, Message
 
 User = get_user_model()
 
-class ChatConsumer(AsyncWebsocketConsumer):
+MESSAGE_FIELDS = ('message_id', 'message', 'sender_id', 'sender_email', 'timestamp', 'read')
+# Tag on this app's frame events (see apps.chatapp.broadcast)
+ORIGIN = 'chatapp_with_token'
+
+
+def room_group(room_id):
+    # own prefix: chatapp's room groups are chat_<id> for a different rooms table
+    return f'token_chat_{room_id}'
+
+
+def envelope(status, status_code, message, data=None):
+    """The status envelope JSON clients receive."""
+    return {'status': status, 'status_code': status_code, 'message': message, 'data': data or {}}
+
+
+def compact_frame(frame_type, status_code, data=None):
+    """MessagePack clients get the type, the status code and the data fields, no envelope strings."""
+    return {'type': frame_type, 'status_code': status_code, **(data or {})}
+
+
+def message_event(data):
+    """
+    Channel-layer event for a new message, its frames encoded once for all
+    recipients. The bare fields stay for workers that predate the frames.
+    """
+    event = {
+        'type': 'chat_message', 'origin': ORIGIN, **data,
+        'frame': encoding.dumps(envelope('success', 200, 'New message received', data)),
+    }
+    if wire.MSGPACK_ENABLED:
+        event['packed'] = wire.pack(compact_frame('chat_message', 200, data))
+    return event
+
+
+class ChatConsumer(WireProtocolMixin, RateLimitMixin, AsyncWebsocketConsumer):
     async def connect(self):
         self.chat_room_id = self.scope['url_route']['kwargs']['room_name']  
-        self.room_group_name = f'chat_{self.chat_room_id}'
+        self.room_group_name = room_group(self.chat_room_id)
 
         query_string = self.scope.get('query_string', b'').decode()
         query_params = {}
@@ -44,7 +81,7 @@ class ChatConsumer(AsyncWebsocketConsumer):
                     self.room_group_name,
                     self.channel_name
                 )
-                await self.accept()
+                await self.accept_wire()
                 await self.mark_messages_as_read()
                 print(f"User {self.user} connected to chat room {self.chat_room_id}")
             else:
@@ -57,58 +94,70 @@ class ChatConsumer(AsyncWebsocketConsumer):
             self.channel_name
         )
 
-    async def receive(self, text_data):
+    async def receive(self, text_data=None, bytes_data=None):
+        if not await self.allow_frame():
+            return
         try:
-            text_data_json = json.loads(text_data)
-            message_content = text_data_json.get('message')
-            message_type = text_data_json.get('type', 'chat_message')
-
-            if message_type == 'chat_message' and message_content:
-                saved_message = await self.save_message(message_content)
-                
-                await self.channel_layer.group_send(
-                    self.room_group_name,
-                    {
-                        'type': 'chat_message',
-                        'message_id': str(saved_message.id),
-                        'message': saved_message.message,
-                        'sender_id': self.user.id,
-                        'sender_email': self.user.email,
-                        'timestamp': saved_message.created_at.isoformat(),
-                        'read': saved_message.read,
-                    }
-                )
-            elif message_type == 'read_receipt':
-                await self.mark_messages_as_read()
-                await self.send(text_data=json.dumps({
-                    'status': 'success',
-                    'status_code': 200,
-                    'message': 'Messages marked as read',
-                    'data': {}
-                }))
-
-        except json.JSONDecodeError:
-            await self.send(text_data=json.dumps({
-                'status': 'error',
-                'status_code': 400,
-                'message': 'Invalid JSON',
-                'data': {}
-            }))
+            text_data_json = self.decode_frame(text_data, bytes_data)
+        except ValueError:
+            await self.send_envelope('error', 'error', 400, 'Invalid JSON')
+            return
+        message_content = text_data_json.get('message')
+        message_type = text_data_json.get('type', 'chat_message')
+
+        if message_type == 'chat_message' and message_content:
+            if not await self.allow_frame_for_user():
+                return
+            saved_message = await self.save_message(message_content)
+            
+            await self.channel_layer.group_send(
+                self.room_group_name,
+                message_event({
+                    'message_id': str(saved_message.id),
+                    'message': saved_message.message,
+                    'sender_id': self.user.id,
+                    'sender_email': self.user.email,
+                    'timestamp': saved_message.created_at.isoformat(),
+                    'read': saved_message.read,
+                })
+            )
+        elif message_type == 'read_receipt':
+            await self.mark_messages_as_read()
+            await self.send_envelope('read_receipt', 'success', 200, 'Messages marked as read')
+
+    def envelope(self, frame_type, status, status_code, message, data=None):
+        if self.wire_binary:
+            return compact_frame(frame_type, status_code, data)
+        return envelope(status, status_code, message, data)
+
+    async def send_envelope(self, frame_type, status, status_code, message, data=None):
+        await self.send_frame(self.envelope(frame_type, status, status_code, message, data))
+
+    async def send_rate_limited(self):
+        await self.send_envelope('error', 'error', 429, 'Too many messages, slow down')
 
     async def chat_message(self, event):
-        await self.send(text_data=json.dumps({
-            'status': 'success',
-            'status_code': 200,
-            'message': 'New message received',
-            'data': {
-                'message_id': event['message_id'],
-                'message': event['message'],
-                'sender_id': event['sender_id'],
-                'sender_email': event['sender_email'],
-                'timestamp': event['timestamp'],
-                'read': event['read'],
-            }
-        }))
+        if is_foreign(event, ORIGIN):
+            return
+        # forward the frame encoded once by the sender (message_event)
+        if self.wire_binary and event.get('packed') is not None:
+            await self.send(bytes_data=event['packed'])
+        elif not self.wire_binary and event.get('frame') is not None:
+            await self.send(text_data=event['frame'])
+        else:
+            await self.send_envelope('chat_message', 'success', 200, 'New message received', {
+                field: event[field] for field in MESSAGE_FIELDS
+            })
+
+    # chatapp room events, should one reach this consumer: nothing to relay
+    async def typing_event(self, event):
+        pass
+
+    async def room_invalidated(self, event):
+        pass
+
+    async def message_failed(self, event):
+        pass
 
     @database_sync_to_async
     def save_message(self, message_content):